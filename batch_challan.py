@@ -0,0 +1,191 @@
+"""
+Headless batch generation for challan.py
+
+Runs the challan and ledger pipelines of the Streamlit app from the command line, e.g.
+from cron, and writes exactly the documents the app's "Download All" ZIPs hold: one ZIP
+(or folder) per input file in the output directory, named after the input and the
+pipeline (march.xlsx -> march_xlsx_challans.zip). Progress and load reports go to stderr.
+
+Usage:
+    python batch_challan.py challans data/*.xlsx --output-dir out --hamali hamali.json
+    python batch_challan.py ledgers data/march.xlsx --output-dir out --old-balances balances.csv
+    python batch_challan.py challans march.csv --output-dir out --format folder --workers 4
+
+hamali.json maps "<FROM>_TO_<TO>" routes to {"loading": ..., "unloading": ...}; routes it
+leaves out use the app's defaults. --old-balances takes a JSON object or a two-column
+CSV of consignor and old balance.
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import warnings
+import zipfile
+
+# challan.py is a Streamlit script; importing it outside `streamlit run` only logs warnings
+warnings.filterwarnings("ignore")
+import streamlit.logger  # noqa: E402
+
+streamlit.logger.set_log_level("error")
+import challan  # noqa: E402
+
+
+# --- Settings Files ---
+
+def read_hamali(path, routes):
+    """route_hamali for every (FROM, TO) route: the app's defaults, overridden by the file."""
+    configured = {}
+    if path:
+        with open(path) as f: configured = json.load(f)
+    return {f"{route_from}_TO_{route_to}": {**challan.DEFAULT_HAMALI,
+                                            **configured.get(f"{route_from}_TO_{route_to}", {})}
+            for route_from, route_to in routes}
+
+
+def read_old_balances(path):
+    """Consignor -> old balance, with names cleaned the way the shipments' are."""
+    if not path: return {}
+    with open(path, newline="") as f:
+        if path.lower().endswith(".json"):
+            balances = json.load(f)
+        else:
+            rows = [row for row in csv.reader(f) if len(row) >= 2]
+            if rows and not _is_number(rows[0][1]): rows = rows[1:]  # header row
+            balances = {name: value for name, value, *_ in rows}
+    return {challan.clean_consignor(name): float(value) for name, value in balances.items()}
+
+
+def _is_number(text):
+    try:
+        float(text)
+    except ValueError:
+        return False
+    return True
+
+
+# --- Progress ---
+
+def stderr_progress(name):
+    """show(fraction, text) printing one line per update, tagged with the input's name."""
+    def show(fraction, text):
+        print(f"[{name}] {fraction:6.1%} {text}", file=sys.stderr, flush=True)
+    return show
+
+
+def stderr_report(name):
+    def show_report(report):
+        for level, message in challan.load_report_lines(report):
+            print(f"[{name}] {level.upper()}: {message}", file=sys.stderr, flush=True)
+    return show_report
+
+
+# --- Batch Runs ---
+
+def write_output(entries, target, fmt, store_only, workers, cache_stats, run_stats, show):
+    """Renders (path, job) entries into target.zip or the target folder."""
+    report = challan.progress_reporter(show, len(entries), "Rendering file", run_stats)
+    if fmt == "folder":
+        challan.save_documents(target, entries, workers, cache_stats, run_stats, report)
+        return target
+    with zipfile.ZipFile(target + ".zip", "w", challan.zip_compression(store_only)) as zf:
+        challan.write_documents(zf, entries, workers, cache_stats, run_stats, report)
+    return target + ".zip"
+
+
+def output_target(path, pipeline, output_dir):
+    """Output path without ".zip" for an input: march.xlsx -> <output_dir>/march_xlsx_challans,
+    so march.xlsx and march.csv do not overwrite each other."""
+    stem, ext = os.path.splitext(os.path.basename(path))
+    return os.path.join(output_dir, f"{stem}_{ext.lstrip('.')}_{pipeline}" if ext else f"{stem}_{pipeline}")
+
+
+def run_challans(path, target, args, cache_stats):
+    name = os.path.basename(path)
+    run_stats = challan.new_run_stats("challans")
+    df = challan.load_shipments_timed(path, load_options(args), run_stats, stderr_report(name))
+    route_hamali = read_hamali(args.hamali, challan.list_routes(df))
+    month_wise_data, challan_count, summary_count, unchanged_count, fingerprints = challan.plan_challans(
+        df, route_hamali, args.incremental, args.output_mode, not args.no_bookmarks, run_stats)
+    output = write_output(challan.challan_entries(month_wise_data), target, args.format, args.store_only,
+                          args.workers, cache_stats, run_stats, stderr_progress(name))
+    challan.save_fingerprints(fingerprints)  # only once every document is written
+    print(f"[{name}] {challan_count - unchanged_count} challan(s), {summary_count} summary report(s), "
+          f"{unchanged_count} unchanged -> {output}", file=sys.stderr)
+    return run_stats
+
+
+def run_ledgers(path, target, args, cache_stats):
+    name = os.path.basename(path)
+    run_stats = challan.new_run_stats("ledgers")
+    ledger_data = challan.generate_weekly_ledgers(
+        path, read_old_balances(args.old_balances), load_options(args), cache_stats, lazy=True,
+        run_stats=run_stats, show_progress=stderr_progress(name), show_report=stderr_report(name))
+    entries = challan.all_ledger_entries(ledger_data, args.excel)
+    output = write_output(entries, target, args.format, args.store_only, args.workers, cache_stats,
+                          run_stats, stderr_progress(name))
+    ledger_count = sum(len(routes) for weeks in ledger_data.values() for routes in weeks.values())
+    print(f"[{name}] {ledger_count} weekly ledger(s) for {len(ledger_data)} consignor(s) -> {output}",
+          file=sys.stderr)
+    return run_stats
+
+
+def load_options(args):
+    return {"chunk_size": args.chunk_size, "workers": args.sheet_workers, "snapshots": not args.no_snapshots}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate challan.py documents without the Streamlit UI")
+    parser.add_argument("pipeline", choices=["challans", "ledgers"])
+    parser.add_argument("inputs", nargs="+", help="Excel, CSV or TSV files; each gets its own output")
+    parser.add_argument("--output-dir", required=True, help="where the ZIPs or folders are written")
+    parser.add_argument("--format", choices=["zip", "folder"], default="zip", help="one ZIP or one folder per input")
+    parser.add_argument("--hamali", help="JSON of route -> loading/unloading hamali (challans)")
+    parser.add_argument("--old-balances", help="JSON or CSV of consignor old balances (ledgers)")
+    parser.add_argument("--output-mode", choices=challan.CHALLAN_OUTPUT_MODES, default="individual",
+                        help="one PDF per challan, one per route and month, or both (challans)")
+    parser.add_argument("--excel", choices=challan.LEDGER_EXCEL_MODES, default="per_ledger",
+                        help="Excel file per weekly ledger, one workbook per consignor, or one in all (ledgers)")
+    parser.add_argument("--no-bookmarks", action="store_true", help="no per-challan bookmarks in route-month PDFs")
+    parser.add_argument("--incremental", action="store_true", help="only challans changed since an earlier run")
+    parser.add_argument("--workers", type=int, default=challan.RENDER_WORKERS, help="rendering processes")
+    parser.add_argument("--sheet-workers", type=int, default=challan.SHEET_WORKERS, help="sheet parsing processes")
+    parser.add_argument("--chunk-size", type=int, help="stream large files in cleaned chunks of this many rows")
+    parser.add_argument("--no-snapshots", action="store_true", help="neither read nor write Parquet snapshots")
+    parser.add_argument("--no-cache", action="store_true", help="render every PDF instead of using the PDF cache")
+    parser.add_argument("--store-only", action="store_true", help="store files in ZIPs without compression")
+    parser.add_argument("--progress-interval", type=float, default=5.0, help="seconds between progress lines")
+    parser.add_argument("--stats", help="also write every run's stage timings to this JSON file")
+    args = parser.parse_args()
+    targets = [output_target(path, args.pipeline, args.output_dir) for path in args.inputs]
+    clashes = sorted({target for target in targets if targets.count(target) > 1})
+    if clashes:
+        parser.error("inputs would overwrite each other's output: " + ", ".join(
+            f"{' and '.join(p for p, t in zip(args.inputs, targets) if t == clash)} -> {clash}"
+            for clash in clashes))
+
+    challan.PROGRESS_INTERVAL = args.progress_interval
+    os.makedirs(args.output_dir, exist_ok=True)
+    run = run_challans if args.pipeline == "challans" else run_ledgers
+    cache_stats = None if args.no_cache else challan.new_cache_stats()
+    runs, failed = [], 0
+    for path, target in zip(args.inputs, targets):
+        try:
+            run_stats = run(path, target, args, cache_stats)
+        except Exception as e:
+            print(f"[{os.path.basename(path)}] ERROR: {e}", file=sys.stderr)
+            failed += 1
+            continue
+        run_stats["input"] = path
+        runs.append(run_stats)
+    if cache_stats:
+        print(f"PDF cache: {cache_stats['hits']} hit(s), {cache_stats['misses']} rendered, "
+              f"{cache_stats['evicted']} evicted", file=sys.stderr)
+    if args.stats:
+        with open(args.stats, "w") as f: json.dump(runs, f, indent=2, default=str)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
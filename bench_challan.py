@@ -0,0 +1,272 @@
+"""
+Ingestion benchmark for challan.py
+
+Generates a synthetic transport workbook in the challan.py column layout and times each
+pipeline stage on it separately: spreadsheet read, date parsing, text/number cleaning,
+grouping, PDF rendering (one file per challan and one consolidated file) and ZIP
+building. Results are written as JSON so runs can be compared between versions.
+
+Usage:
+    python bench_challan.py --rows 200000 --sheets 4 --output bench.json
+    python bench_challan.py --rows 20000 --legacy          # also time the per-cell functions
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+import zipfile
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# challan.py is a Streamlit script; importing it outside `streamlit run` only logs warnings
+warnings.filterwarnings("ignore")
+logging.getLogger("streamlit").setLevel(logging.ERROR)
+import challan  # noqa: E402
+
+CITIES = ["MUMBAI", "Bombay", "DELHI", "new-delhi", "NAGPUR", "Bhopal", "PUNE", "INDORE",
+          "RAIPUR", "JABALPUR", "Surat", "AHMEDABAD", "HYDERABAD", "Kolkata", "CHENNAI"]
+DATE_STYLES = ["%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%d/%m/%y", "%d-%m-%y", "%Y-%m-%d 00:00:00"]
+DRIVERS = ["RAMESH", "suresh  kumar", "NA", "-", "Mahesh", "n/a", "DINESH YADAV", "raju"]
+
+
+# --- Synthetic Workbook ---
+
+def make_shipments(rows, routes=20, consignors=200, messy_dates=True, seed=7):
+    """One DataFrame of raw (all text) rows; every challan has 1-6 rows."""
+    rng = np.random.default_rng(seed)
+    rows_per_challan = rng.integers(1, 7, size=rows)
+    serial = np.repeat(np.arange(1, rows + 1), rows_per_challan)[:rows]
+    n_challans = serial.max()
+
+    route_pairs = [(CITIES[i % len(CITIES)], CITIES[(i * 7 + 3) % len(CITIES)]) for i in range(routes)]
+    challan_route = rng.integers(0, routes, size=n_challans + 1)[serial]
+    challan_day = rng.integers(0, 365, size=n_challans + 1)[serial]
+    challan_driver = rng.integers(0, len(DRIVERS), size=n_challans + 1)[serial]
+    dates = pd.Timestamp("2024-01-01") + pd.to_timedelta(challan_day, unit="D")
+    styles = rng.integers(0, len(DATE_STYLES) if messy_dates else 1, size=n_challans + 1)[serial]
+    date_text = np.empty(rows, dtype=object)
+    for i, fmt in enumerate(DATE_STYLES):
+        mask = styles == i
+        date_text[mask] = dates[mask].strftime(fmt)
+
+    consignor_names = [f"Party {i} Traders" if i % 3 else f"party  {i} traders" for i in range(consignors)]
+    wt = rng.integers(10, 2000, size=rows)
+    freight = rng.choice([2.0, 2.5, 3.0, 3.25], size=rows)
+    return pd.DataFrame({
+        "S. NO.": serial.astype(str),
+        "DATE": date_text,
+        "FROM": [route_pairs[r][0] for r in challan_route],
+        "TO": [route_pairs[r][1] for r in challan_route],
+        "TRUCK NO.": [f"MH{s % 50:02d}AB{s % 9999:04d}" for s in serial],
+        "NAME OF THE DRIVER": [DRIVERS[d] for d in challan_driver],
+        "DRIVER MOB. NO.": (9000000000 + serial).astype(str),
+        "CONSIGNOR": rng.choice(consignor_names, size=rows),
+        "CONSIGNEE": rng.choice([f"Consignee {i}" for i in range(50)], size=rows),
+        "WT. Kgs.": wt.astype(str),
+        "NO. OF Pkgs": rng.integers(1, 40, size=rows).astype(str),
+        "FREIGHT": freight.astype(str),
+        "AMOUNT": (wt * freight).round(2).astype(str),
+        "Hire": rng.choice(["5000", "6000", "7500", ""], size=rows),
+    })
+
+
+def write_workbook(df, sheets, path):
+    """Splits rows evenly over `sheets` sheets (one per month/branch) and saves the file.
+    A .csv/.tsv path writes a single delimited file instead."""
+    sep = challan.delimiter_for(path)
+    if sep:
+        df.to_csv(path, index=False, sep=sep)
+        return
+    with pd.ExcelWriter(path, engine="openpyxl") as writer:
+        for i, part in enumerate(np.array_split(np.arange(len(df)), sheets)):
+            df.iloc[part].to_excel(writer, sheet_name=f"Sheet{i + 1}", index=False)
+
+
+# --- Stage Timing ---
+
+class Timer:
+    def __init__(self):
+        self.stages = {}
+
+    def run(self, name, fn, items=None):
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        result = fn()
+        wall, cpu = time.perf_counter() - start_wall, time.process_time() - start_cpu
+        stage = {"seconds": round(wall, 4), "cpu_seconds": round(cpu, 4)}
+        if items is not None:
+            count = items(result) if callable(items) else items
+            stage["items"] = count
+            stage["items_per_sec"] = round(count / wall, 1) if wall else None
+        self.stages[name] = stage
+        print(f"{name:<22} {wall:8.3f}s", file=sys.stderr)
+        return result
+
+
+def challan_jobs(df, limit):
+    """(meta, rows) for the first `limit` challans, as process_excel_file builds them."""
+    challans, line_items, _ = challan.aggregate_challans(df)
+    route_hamali = {f"{f}_TO_{t}": {"loading": 1700, "unloading": 1700}
+                    for f, t in zip(challans["FROM"], challans["TO"])}
+    return [(challan.challan_meta(c, route_hamali), line_items[c["start"]:c["end"]])
+            for c in challans.head(limit).to_dict("records")]
+
+
+def render_all(jobs, workers):
+    pdfs = challan.render_pdfs([("challan", job) for job in jobs], workers)
+    return [(f"{meta['challan_no']}.pdf", pdf) for (meta, _), pdf in zip(jobs, pdfs)]
+
+
+def render_book(jobs, bookmarks=True):
+    """The same challans as one consolidated multi-page PDF."""
+    buffer = io.BytesIO()
+    challan.draw_challan_book(buffer, jobs, bookmarks)
+    return buffer.getvalue()
+
+
+def compare_renderings(expected, actual, scale=2):
+    """Rasterizes both lists of PDFs page by page and counts pages whose pixels differ.
+    Needs pypdfium2 and Pillow; returns None when they are not installed."""
+    try:
+        import pypdfium2 as pdfium
+        from PIL import ImageChops
+    except ImportError:
+        return None
+    pages = differing = 0
+    for (_, a), (_, b) in zip(expected, actual):
+        doc_a, doc_b = pdfium.PdfDocument(a), pdfium.PdfDocument(b)
+        if len(doc_a) != len(doc_b):
+            pages, differing = pages + max(len(doc_a), len(doc_b)), differing + max(len(doc_a), len(doc_b))
+            continue
+        for page_a, page_b in zip(doc_a, doc_b):
+            image_a = page_a.render(scale=scale).to_pil().convert("RGB")
+            image_b = page_b.render(scale=scale).to_pil().convert("RGB")
+            pages += 1
+            differing += ImageChops.difference(image_a, image_b).getbbox() is not None
+    return {"pages": pages, "differing": differing}
+
+
+def zip_all(pdfs):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, data in pdfs:
+            zf.writestr(name, data)
+    return buffer.getvalue()
+
+
+def run_benchmark(args):
+    timer = Timer()
+    path = args.workbook
+    if not path:
+        raw = timer.run("generate", lambda: make_shipments(args.rows, args.routes, args.consignors,
+                                                           not args.clean_dates, args.seed), args.rows)
+        path = os.path.join(args.workdir, f"bench_{args.rows}.{args.format}")
+        timer.run("write_workbook", lambda: write_workbook(raw, args.sheets, path), args.rows)
+    content = challan.read_upload(path)
+
+    sep = challan.delimiter_for(path)
+    if sep:
+        read = lambda: challan._read_delimited(content, sep)
+    else:
+        read = lambda: pd.concat(pd.read_excel(io.BytesIO(content), sheet_name=None, dtype=str).values(),
+                                 ignore_index=True)
+    df = timer.run("read", read, len)
+    df.columns, _ = challan.normalize_headers(df.columns)
+
+    timer.run("parse_dates", lambda: challan.parse_date_column(df["DATE"]), len(df))
+    timer.run("clean_city", lambda: (challan.clean_city_column(df["FROM"]), challan.clean_city_column(df["TO"])),
+              2 * len(df))
+    timer.run("clean_driver", lambda: challan.clean_driver_column(df["NAME OF THE DRIVER"]), len(df))
+    timer.run("clean_consignor", lambda: challan.clean_consignor_column(df["CONSIGNOR"]), len(df))
+    if args.legacy:
+        timer.run("parse_dates_per_cell", lambda: df["DATE"].apply(challan.parse_date_flexible), len(df))
+        timer.run("clean_text_per_cell", lambda: (df["FROM"].apply(challan.clean_city),
+                                                  df["NAME OF THE DRIVER"].apply(challan.clean_driver),
+                                                  df["CONSIGNOR"].apply(challan.clean_consignor)), 3 * len(df))
+    typed, _ = timer.run("apply_schema", lambda: challan.apply_schema(df.copy()), len(df))
+
+    timer.run("load_shipments", lambda: challan._combine_parts(
+        challan._parse_sheets(content, pd.ExcelFile(io.BytesIO(content)).sheet_names, args.workers)
+        if not sep else [challan._parse_delimited(content, sep)]), len(df))
+
+    timer.run("groupby_challans", lambda: typed.groupby(
+        ["S. NO.", "DATE", "NAME OF THE DRIVER", "FROM", "TO"], observed=True).ngroups)
+    jobs = timer.run("build_challans", lambda: challan_jobs(typed, args.render_limit), len)
+    challan.TABLE_RENDERER = args.table_renderer
+    pdfs = timer.run("render_pdfs", lambda: render_all(jobs, args.render_workers), len)
+    book = timer.run("render_book", lambda: render_book(jobs), len(jobs))
+    table_check = None
+    if args.compare_tables:
+        # both renderers in this process, so the timings compare like for like
+        for renderer in ("platypus", "grid"):
+            challan.TABLE_RENDERER = renderer
+            rendered = timer.run(f"render_pdfs_{renderer}", lambda: render_all(jobs, 1), len)
+            if renderer == "platypus": reference = rendered
+        challan.TABLE_RENDERER = args.table_renderer
+        table_check = timer.run("visual_diff", lambda: compare_renderings(reference, rendered))
+    archive = timer.run("build_zip", lambda: zip_all(pdfs), len(pdfs))
+
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "version": git_version(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "workdir")},
+        "workbook_bytes": len(content),
+        "pdf_bytes": sum(len(data) for _, data in pdfs),
+        "zip_bytes": len(archive),
+        "book_bytes": len(book),
+        "stages": timer.stages,
+        "table_renderer_diff": table_check,
+    }
+
+
+def git_version():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the challan.py ingestion and rendering stages")
+    parser.add_argument("--rows", type=int, default=20000, help="shipment rows to generate")
+    parser.add_argument("--sheets", type=int, default=3, help="sheets in the workbook (one per month/branch)")
+    parser.add_argument("--routes", type=int, default=20, help="distinct FROM/TO routes")
+    parser.add_argument("--consignors", type=int, default=200, help="distinct consignors")
+    parser.add_argument("--clean-dates", action="store_true", help="use only DD/MM/YYYY dates")
+    parser.add_argument("--format", choices=["xlsx", "csv", "tsv"], default="xlsx", help="generated file type")
+    parser.add_argument("--workbook", help="benchmark this existing file instead of generating one")
+    parser.add_argument("--workers", type=int, default=challan.SHEET_WORKERS, help="sheet parsing processes")
+    parser.add_argument("--render-workers", type=int, default=challan.RENDER_WORKERS, help="PDF rendering processes")
+    parser.add_argument("--table-renderer", choices=["grid", "platypus"], default=challan.TABLE_RENDERER,
+                        help="table renderer for the render_pdfs stage")
+    parser.add_argument("--compare-tables", action="store_true",
+                        help="time both table renderers and pixel-compare their output (needs pypdfium2, Pillow)")
+    parser.add_argument("--render-limit", type=int, default=500, help="challans to render and zip")
+    parser.add_argument("--legacy", action="store_true", help="also time the per-cell parse/clean functions")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--workdir", default=tempfile.gettempdir(), help="where the generated workbook is written")
+    parser.add_argument("--output", help="JSON results file (default: stdout)")
+    args = parser.parse_args()
+
+    results = run_benchmark(args)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f: f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
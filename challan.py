@@ -1,17 +1,32 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import os
 import io
 import zipfile
+import hashlib
+import json
+import pickle
+import copy
+import contextlib
+import functools
+import itertools
+import struct
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import mm
 from reportlab.platypus import Table, TableStyle
 from reportlab.lib import colors
+from reportlab.pdfbase.pdfmetrics import stringWidth
 
 # --- Custom CSS for professional look ---
-st.markdown("""
+APP_CSS = """
 <style>
     .main-header {
         text-align: center;
@@ -43,33 +58,84 @@ st.markdown("""
         margin: 1rem 0;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
 
 # --- Utility Functions ---
 
+DATE_FORMATS = ["%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%d/%m/%y", "%d-%m-%y"]
+# datetime64[ns] stops at 2262; microseconds hold every date parse_date_flexible returns,
+# so a typo like 09/01/3024 parses instead of failing the sheet
+DATE_DTYPE = "datetime64[us]"
+
 def parse_date_flexible(date_str):
     if pd.isna(date_str): return pd.NaT
     date_str = str(date_str).strip()
-    formats = ["%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%d/%m/%y", "%d-%m-%y"]
-    for fmt in formats:
+    for fmt in DATE_FORMATS:
         try: return pd.to_datetime(date_str, format=fmt)
         except: continue
     try: return pd.to_datetime(date_str, dayfirst=True)
     except: return pd.NaT
 
+def parse_date_column(values):
+    """Column-level parse_date_flexible: every distinct raw string is parsed once,
+    each known format is tried as one vectorized to_datetime over what is still
+    unparsed, and only the leftovers go through the dayfirst fallback.
+    Returns (dates, format_counts) where format_counts maps format -> rows matched.
+    Timezone-aware strings keep the wall time they were written with; a value no
+    DATE_DTYPE can hold counts as "unparsed" rather than failing the sheet."""
+    values = pd.Series(values)
+    present = values.notna()
+    codes, uniques = pd.factorize(values[present].astype(str).str.strip())
+    rows_per_value = pd.Series(codes).value_counts().reindex(range(len(uniques)), fill_value=0)
+
+    parsed = pd.Series(pd.NaT, index=range(len(uniques)), dtype=DATE_DTYPE)
+    pending = pd.Series(uniques, dtype=object)
+    format_counts = {}
+    for fmt in DATE_FORMATS:
+        if pending.empty: break
+        hit = pd.to_datetime(pending, format=fmt, errors="coerce")
+        matched = hit.notna()
+        parsed[pending.index[matched]] = hit[matched].astype(DATE_DTYPE)
+        format_counts[fmt] = int(rows_per_value[pending.index[matched]].sum())
+        pending = pending[~matched]
+
+    fallback_rows = 0
+    for i, raw in pending.items():
+        try:
+            value = pd.to_datetime(raw, dayfirst=True)
+            if pd.isna(value): continue
+            if value.tzinfo is not None: value = value.tz_localize(None)
+            parsed[i] = value.as_unit("us")
+        except Exception:
+            continue
+        fallback_rows += int(rows_per_value[i])
+    format_counts["dayfirst"] = fallback_rows
+    format_counts["unparsed"] = int(len(values) - sum(format_counts.values()))
+
+    dates = pd.Series(pd.NaT, index=values.index, dtype=DATE_DTYPE)
+    dates[present] = parsed.to_numpy()[codes]
+    return dates, format_counts
+
+def format_date_counts(format_counts):
+    return ", ".join(f"{fmt}: {n}" for fmt, n in format_counts.items() if n)
+
+# Standardized city names, applied after punctuation/whitespace cleanup
+CITY_ALIASES = {
+    "BOMBAY": "MUMBAI",
+}
+DRIVER_NA_VALUES = ["", "NA", "N/A", "NONE", "-", "--"]
+
 def clean_city(x):
     if not isinstance(x, str): return ""
     x = x.upper().strip()
     x = x.replace(".", "").replace(",", "").replace("-", " ").strip()
-    # Standardize city names
-    if x in ["BOMBAY", "MUMBAI"]: return "MUMBAI"
-    if x in ["DELHI"]: return "DELHI"
-    return " ".join(x.split())
+    x = " ".join(x.split())
+    return CITY_ALIASES.get(x, x)
 
 def clean_driver(x):
     if not isinstance(x, str): return "NA"
     x = x.upper().strip()
-    if x in ["", "NA", "N/A", "NONE", "-", "--"]: return "NA"
+    if x in DRIVER_NA_VALUES: return "NA"
     return " ".join(x.split())
 
 def clean_consignor(x):
@@ -77,6 +143,42 @@ def clean_consignor(x):
     x = x.upper().strip()
     return " ".join(x.split())
 
+def _clean_text_column(values, clean_text, default):
+    """Runs a vectorized `.str` cleaner over the distinct values of a column only
+    and returns a categorical with lexically sorted categories (so groupby order
+    matches plain strings). Non-string cells become `default`."""
+    raw = pd.Series(values).astype("category")
+    raw_categories = pd.Series(raw.cat.categories, dtype=object)
+    is_text = raw_categories.map(lambda v: isinstance(v, str)).astype(bool)
+    cleaned = pd.Series(default, index=raw_categories.index, dtype=object)
+    if is_text.any():
+        cleaned[is_text] = clean_text(raw_categories[is_text].astype(str).str.upper().str.strip())
+    categories = pd.Index(sorted(set(cleaned) | {default}))
+    # Missing cells (code -1) index the default's code appended last, which also covers
+    # a column with no values at all
+    category_codes = np.append(categories.get_indexer(cleaned), categories.get_loc(default))
+    codes = category_codes[raw.cat.codes.to_numpy()]
+    return pd.Series(pd.Categorical.from_codes(codes, categories=categories), index=raw.index)
+
+def _collapse_spaces(s):
+    return s.str.split().str.join(" ")
+
+def clean_city_column(values, aliases=None):
+    aliases = CITY_ALIASES if aliases is None else aliases
+    def clean_text(s):
+        s = s.str.replace(".", "", regex=False).str.replace(",", "", regex=False)
+        s = _collapse_spaces(s.str.replace("-", " ", regex=False))
+        return s.map(aliases).fillna(s)
+    return _clean_text_column(values, clean_text, "")
+
+def clean_driver_column(values):
+    def clean_text(s):
+        return _collapse_spaces(s).where(~s.isin(DRIVER_NA_VALUES), "NA")
+    return _clean_text_column(values, clean_text, "NA")
+
+def clean_consignor_column(values):
+    return _clean_text_column(values, _collapse_spaces, "")
+
 def clean_num(x):
     try:
         val = float(str(x).strip())
@@ -97,25 +199,170 @@ def get_week_info(date):
 
 # --- PDF Generation Functions (Challan) ---
 
-def draw_pdf(pdf_buffer, meta, rows):
-    c = canvas.Canvas(pdf_buffer, pagesize=A4)
+# --- Fixed-Grid Tables ---
+
+TABLE_RENDERER = os.environ.get("CHALLAN_TABLE_RENDERER", "grid")  # "grid" or "platypus"
+GRID_LEADING = 12
+GRID_PADDING = (6, 6, 3, 3)  # left, right, top, bottom: the platypus Table defaults
+GRID_CELL_STYLE = {"FONTNAME": "Helvetica", "FONTSIZE": 10, "TEXTCOLOR": colors.black,
+                   "ALIGN": "LEFT", "VALIGN": "BOTTOM"}
+GRID_LINE_COMMANDS = {"GRID", "LINEABOVE", "LINEBELOW"}
+GRID_COMMANDS = set(GRID_CELL_STYLE) | GRID_LINE_COMMANDS | {"BACKGROUND"}
+
+def draw_table(c, data, col_widths, style, x, y_top, renderer=None):
+    """Draws `data` as a table with its top-left corner at (x, y_top) and returns its height.
+    style is a list of TableStyle commands. The "grid" renderer draws the fixed grid
+    straight onto the canvas; "platypus", or a style using commands the grid renderer
+    does not know, lays it out with a platypus Table instead."""
+    if (renderer or TABLE_RENDERER) == "grid" and all(cmd[0] in GRID_COMMANDS for cmd in style):
+        return _draw_grid(c, data, col_widths, style, x, y_top)
+    table = Table(data, colWidths=col_widths)
+    table.setStyle(TableStyle(style))
+    w, h = table.wrap(0, 0)
+    table.drawOn(c, x, y_top - h)
+    return h
+
+def _cell_range(start, end, nrows, ncols):
+    (sc, sr), (ec, er) = start, end
+    sc, ec = (sc + ncols if sc < 0 else sc), (ec + ncols if ec < 0 else ec)
+    sr, er = (sr + nrows if sr < 0 else sr), (er + nrows if er < 0 else er)
+    return max(0, sc), min(ncols - 1, ec), max(0, sr), min(nrows - 1, er)
+
+def _draw_grid(c, data, col_widths, style, x, y_top):
+    """Same geometry, fills, text placement and rules as platypus Table for the commands
+    in GRID_COMMANDS, with every cell's text drawn through one text object."""
+    nrows, ncols = len(data), len(col_widths)
+    left_pad, right_pad, top_pad, bottom_pad = GRID_PADDING
+    cells = [[dict(GRID_CELL_STYLE) for _ in range(ncols)] for _ in range(nrows)]
+    backgrounds, lines = [], []
+    for op, start, end, *values in style:
+        sc, ec, sr, er = _cell_range(start, end, nrows, ncols)
+        if op == "BACKGROUND":
+            backgrounds.append((sc, ec, sr, er, values[0]))
+        elif op in GRID_LINE_COMMANDS:
+            lines.append((op, sc, ec, sr, er, values[0], values[1]))
+        else:
+            for row in cells[sr:er + 1]:
+                for cell in row[sc:ec + 1]:
+                    cell[op] = values[0]
+
+    texts = [[str(v if v is not None else "").split("\n") for v in row] for row in data]
+    heights = [GRID_LEADING * max(len(t) for t in row) + top_pad + bottom_pad for row in texts]
+    height = sum(heights)
+    col_pos = [0]
+    for w in col_widths: col_pos.append(col_pos[-1] + w)
+    row_pos = [height]  # row_pos[i] is the top of row i, row_pos[i + 1] its bottom
+    for h in heights: row_pos.append(row_pos[-1] - h)
+
+    c.saveState()
+    c.translate(x, y_top - height)
+    for sc, ec, sr, er, color in backgrounds:
+        c.setFillColor(color)
+        c.rect(col_pos[sc], row_pos[sr], col_pos[ec + 1] - col_pos[sc], row_pos[er + 1] - row_pos[sr],
+               stroke=0, fill=1)
+
+    text = c.beginText()
+    font = color = None
+    for r, (row, row_texts) in enumerate(zip(cells, texts)):
+        bottom, row_height = row_pos[r + 1], heights[r]
+        for col, (cell, lines_) in enumerate(zip(row, row_texts)):
+            if (cell["FONTNAME"], cell["FONTSIZE"]) != font:
+                font = cell["FONTNAME"], cell["FONTSIZE"]
+                text.setFont(*font, leading=GRID_LEADING)
+            if cell["TEXTCOLOR"] != color:
+                color = cell["TEXTCOLOR"]
+                text.setFillColor(color)
+            fontsize = cell["FONTSIZE"]
+            if cell["VALIGN"] == "TOP":
+                y = bottom + row_height - top_pad - fontsize
+            elif cell["VALIGN"] == "MIDDLE":
+                y = bottom + (bottom_pad + row_height - top_pad + len(lines_) * GRID_LEADING) / 2.0 - fontsize
+            else:
+                y = bottom + bottom_pad + len(lines_) * GRID_LEADING - fontsize
+            for line in lines_:
+                if line:
+                    align = cell["ALIGN"]
+                    if align == "LEFT":
+                        tx = col_pos[col] + left_pad
+                    else:
+                        width = stringWidth(line, *font)
+                        if align in ("CENTRE", "CENTER"):
+                            tx = col_pos[col] + (col_widths[col] + left_pad - right_pad) * 0.5 - 0.5 * width
+                        else:
+                            tx = col_pos[col + 1] - right_pad - width
+                    text.setTextOrigin(tx, y)
+                    text.textOut(line)
+                y -= GRID_LEADING
+    c.drawText(text)
+
+    c.setLineCap(1)
+    c.setLineJoin(1)
+    for op, sc, ec, sr, er, weight, color in lines:
+        x0, x1 = col_pos[sc], col_pos[ec + 1]
+        if op == "GRID":  # outer box, then inner rules, in the order platypus strokes them
+            top, bottom = row_pos[sr], row_pos[er + 1]
+            rules = [(x0, top, x1, top), (x0, bottom, x1, bottom),
+                     (x0, bottom, x0, top), (x1, bottom, x1, top)]
+            rules += [(x0, y, x1, y) for y in row_pos[sr + 1:er + 1]]
+            rules += [(cx, bottom, cx, top) for cx in col_pos[sc + 1:ec + 1]]
+        else:
+            first = sr + 1 if op == "LINEBELOW" else sr
+            rules = [(x0, y, x1, y) for y in row_pos[first:first + er - sr + 1]]
+        c.setStrokeColor(color)
+        c.setLineWidth(weight)
+        for rule in rules:  # one stroke each, as overlapping antialiased edges render differently in one path
+            c.line(*rule)
+    c.restoreState()
+    return height
+
+# --- Static Page Templates ---
+
+PDF_INVARIANT = True  # fixed creation date and document ID: equal inputs give equal bytes
+TEMPLATE_FONTS = ("Helvetica", "Helvetica-Bold")
+CHALLAN_MARGIN = 15 * mm
+CHALLAN_GRID_Y = A4[1] - 80
+CHALLAN_ROW_HEIGHT = 20
+
+def _can_replay(c):
+    """True when the canvas exposes the reportlab internals (`_code`, `_doc`) that
+    recording and replaying a template rely on; they are private and may change."""
+    return hasattr(c, "_code") and hasattr(getattr(c, "_doc", None), "getInternalFontName")
+
+@functools.lru_cache(maxsize=None)
+def _template_ops(draw):
+    """(internal font names, PDF operators) that draw(c) emits, recorded once per process
+    on a scratch canvas; None when this reportlab cannot be recorded from."""
+    c = canvas.Canvas(io.BytesIO(), pagesize=A4)
+    if not _can_replay(c):
+        return None
+    fonts = tuple(c._doc.getInternalFontName(f) for f in TEMPLATE_FONTS)
+    start = len(c._code)
+    draw(c)
+    return fonts, "\n".join(c._code[start:])
+
+def draw_template(c, draw):
+    """Draws the static content `draw` produces by replaying its recorded operators
+    rather than laying the text and lines out again. A canvas that numbers its fonts
+    differently from the recording, or a reportlab without the internals, gets draw(c)."""
+    recorded = _template_ops(draw) if _can_replay(c) else None
+    if recorded and tuple(c._doc.getInternalFontName(f) for f in TEMPLATE_FONTS) == recorded[0]:
+        c.addLiteral(recorded[1])
+    else:
+        draw(c)
+
+def _challan_header(c):
+    """Company title, the header grid and its labels: identical on every challan."""
     pw, ph = A4
-    margin = 15 * mm
-
+    margin = CHALLAN_MARGIN
     c.setFont("Helvetica-Bold", 16)
     title = "NAGPUR BHOPAL TRANSPORT COMPANY"
     title_width = c.stringWidth(title, "Helvetica-Bold", 16)
     c.drawString((pw - title_width) / 2, ph - 35, title)
 
-    c.setFont("Helvetica-Bold", 12)
-    route_text = f"{meta['FROM']} TO {meta['TO']} - {meta['month']}"
-    route_width = c.stringWidth(route_text, "Helvetica-Bold", 12)
-    c.drawString((pw - route_width) / 2, ph - 53, route_text)
-
-    grid_start_y = ph - 80
+    grid_start_y = CHALLAN_GRID_Y
     grid_width = pw - 2 * margin
     col_width = grid_width / 2
-    row_height = 20
+    row_height = CHALLAN_ROW_HEIGHT
 
     c.setLineWidth(0.5)
     c.rect(margin, grid_start_y - 3*row_height, grid_width, 3*row_height)
@@ -126,20 +373,67 @@ def draw_pdf(pdf_buffer, meta, rows):
     c.setFont("Helvetica", 10)
     y_pos = grid_start_y - 14
     c.drawString(margin + 5, y_pos, "Challan No.:")
-    c.drawString(margin + 80, y_pos, str(meta['challan_no']))
     c.drawString(margin + col_width + 5, y_pos, "Vehicle No.:")
-    c.drawString(margin + col_width + 80, y_pos, str(meta['truck']))
-
     y_pos -= row_height
     c.drawString(margin + 5, y_pos, "Date:")
-    c.drawString(margin + 80, y_pos, str(meta['date']))
     c.drawString(margin + col_width + 5, y_pos, "Broker:")
     c.drawString(margin + col_width + 80, y_pos, "NA")
-
     y_pos -= row_height
     c.drawString(margin + 5, y_pos, "Driver Name:")
-    c.drawString(margin + 80, y_pos, str(meta['driver']))
     c.drawString(margin + col_width + 5, y_pos, "Driver Mob no.:")
+
+def _challan_summary_labels(c):
+    """Labels of the expense summary under the table, relative to its first line."""
+    margin = CHALLAN_MARGIN
+    c.setFont("Helvetica", 11)
+    for i, label in enumerate(["GADI BHADAA", "LOADING HAMALI", "UNLOADING HAMALI", "OTHER EXP."]):
+        c.drawString(margin + 8, -18 * i, label)
+    c.setFont("Helvetica-Bold", 11)
+    c.drawString(margin + 8, -74, "BALANCE")
+
+def draw_pdf(pdf_buffer, meta, rows):
+    c = canvas.Canvas(pdf_buffer, pagesize=A4, invariant=PDF_INVARIANT)
+    _draw_challan_page(c, meta, rows)
+    c.save()
+
+def draw_challan_book(pdf_buffer, challans, bookmarks=True):
+    """Draws every (meta, rows) challan as a consecutive page of one PDF, so fonts and
+    resources are written once for all of them. With bookmarks, each page gets an outline
+    entry under its challan number."""
+    c = canvas.Canvas(pdf_buffer, pagesize=A4, invariant=PDF_INVARIANT)
+    for i, (meta, rows) in enumerate(challans):
+        if bookmarks:
+            c.bookmarkPage(f"challan_{i}")
+            c.addOutlineEntry(f"Challan {meta['challan_no']} ({meta['date']})", f"challan_{i}", level=0)
+        _draw_challan_page(c, meta, rows)
+    if bookmarks:
+        c.showOutline()
+    c.save()
+
+def _draw_challan_page(c, meta, rows):
+    """One challan on the current page of `c`, ending the page."""
+    pw, ph = A4
+    margin = CHALLAN_MARGIN
+    draw_template(c, _challan_header)
+
+    c.setFont("Helvetica-Bold", 12)
+    route_text = f"{meta['FROM']} TO {meta['TO']} - {meta['month']}"
+    route_width = c.stringWidth(route_text, "Helvetica-Bold", 12)
+    c.drawString((pw - route_width) / 2, ph - 53, route_text)
+
+    grid_start_y = CHALLAN_GRID_Y
+    grid_width = pw - 2 * margin
+    col_width = grid_width / 2
+    row_height = CHALLAN_ROW_HEIGHT
+
+    c.setFont("Helvetica", 10)
+    y_pos = grid_start_y - 14
+    c.drawString(margin + 80, y_pos, str(meta['challan_no']))
+    c.drawString(margin + col_width + 80, y_pos, str(meta['truck']))
+    y_pos -= row_height
+    c.drawString(margin + 80, y_pos, str(meta['date']))
+    y_pos -= row_height
+    c.drawString(margin + 80, y_pos, str(meta['driver']))
     c.drawString(margin + col_width + 85, y_pos, str(meta['driver_mob']))
 
     table_start_y = grid_start_y - 3*row_height - 25
@@ -157,8 +451,7 @@ def draw_pdf(pdf_buffer, meta, rows):
         "", str(round(meta['total_amount'], 1))
     ])
     col_widths = [35, 90, 90, 55, 60, 55, 65]
-    table = Table(table_data, colWidths=col_widths)
-    table.setStyle(TableStyle([
+    h = draw_table(c, table_data, col_widths, [
         ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#4472C4')),
         ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
         ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
@@ -174,40 +467,29 @@ def draw_pdf(pdf_buffer, meta, rows):
         ('GRID', (0, 0), (-1, -1), 1, colors.black),
         ('LINEBELOW', (0, 0), (-1, 0), 2, colors.black),
         ('LINEABOVE', (0, -1), (-1, -1), 2, colors.black),
-    ]))
-    w, h = table.wrap(0, 0)
-    table.drawOn(c, margin, table_start_y - h)
+    ], margin, table_start_y)
 
     summary_y = table_start_y - h - 25
+    c.saveState()
+    c.translate(0, summary_y)
+    draw_template(c, _challan_summary_labels)
+    c.restoreState()
     c.setFont("Helvetica", 11)
-    c.drawString(margin + 8, summary_y, "GADI BHADAA")
-    c.drawRightString(pw - margin - 8, summary_y, str(int(meta['hire'])))
-    summary_y -= 18
-    c.drawString(margin + 8, summary_y, "LOADING HAMALI")
-    c.drawRightString(pw - margin - 8, summary_y, str(int(meta['hamali_loading'])))
-    summary_y -= 18
-    c.drawString(margin + 8, summary_y, "UNLOADING HAMALI")
-    c.drawRightString(pw - margin - 8, summary_y, str(int(meta['hamali_unloading'])))
-    summary_y -= 18
-    c.drawString(margin + 8, summary_y, "OTHER EXP.")
-    c.drawRightString(pw - margin - 8, summary_y, str(int(meta['other_exp'])))
-    summary_y -= 20
+    for i, key in enumerate(["hire", "hamali_loading", "hamali_unloading", "other_exp"]):
+        c.drawRightString(pw - margin - 8, summary_y - 18 * i, str(int(meta[key])))
     c.setFont("Helvetica-Bold", 11)
-    c.drawString(margin + 8, summary_y, "BALANCE")
-    c.drawRightString(pw - margin - 8, summary_y, str(round(meta['balance'], 1)))
+    c.drawRightString(pw - margin - 8, summary_y - 74, str(round(meta['balance'], 1)))
 
     c.showPage()
-    c.save()
 
 def draw_summary_pdf(pdf_buffer, route_from, route_to, month_year, summary_rows):
-    c = canvas.Canvas(pdf_buffer, pagesize=A4)
+    c = canvas.Canvas(pdf_buffer, pagesize=A4, invariant=PDF_INVARIANT)
     pw, ph = A4
     margin = 15 * mm
 
-    totals = {"qty": 0, "weight": 0, "topay": 0, "hire": 0, "hamali": 0, "balance": 0}
-    for row in summary_rows:
-        for key in totals:
-            totals[key] += float(row[key]) if row[key] else 0
+    # Rows as built by summarize_routes: numbers, already rounded as printed
+    totals = {key: sum(row[key] for row in summary_rows)
+              for key in ("qty", "weight", "topay", "hire", "hamali", "balance")}
 
     available_height = ph - 120
     row_height = 20
@@ -229,10 +511,9 @@ def draw_summary_pdf(pdf_buffer, route_from, route_to, month_year, summary_rows)
         table_data = [["Sr.\nNo.", "Date", "Truck No.", "Chal- No.", "QTY", "Weight", "Topay", "Hire", "Hamali", "Balance - AMT"]]
         start_idx, end_idx = page_num * rows_per_page, min((page_num + 1) * rows_per_page, total_data_rows)
         for i, row in enumerate(summary_rows[start_idx:end_idx], start=start_idx + 1):
-            table_data.append([
-                str(i), row["date"], row["truck_no"], row["challan_no"], row["qty"],
-                row["weight"], row["topay"], row["hire"], row["hamali"], row["balance"]
-            ])
+            date = row["date"].strftime("%d/%m/%Y") if not pd.isna(row["date"]) else ""
+            table_data.append([str(i), date, row["truck_no"], str(row["challan_no"])]
+                              + [str(row[key]) for key in ("qty", "weight", "topay", "hire", "hamali", "balance")])
         if page_num == num_pages - 1:
             table_data.append([
                 "TOTAL", "", "", "", str(int(totals["qty"])), str(int(totals["weight"])),
@@ -240,7 +521,6 @@ def draw_summary_pdf(pdf_buffer, route_from, route_to, month_year, summary_rows)
                 str(int(totals["hamali"])), str(round(totals["balance"], 1))
             ])
         col_widths = [30, 50, 55, 45, 35, 45, 50, 45, 45, 65]
-        table = Table(table_data, colWidths=col_widths)
         style = [
             ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#4472C4')),
             ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
@@ -262,9 +542,7 @@ def draw_summary_pdf(pdf_buffer, route_from, route_to, month_year, summary_rows)
                 ('FONTSIZE', (0, -1), (-1, -1), 10),
                 ('LINEABOVE', (0, -1), (-1, -1), 2, colors.black)
             ])
-        table.setStyle(TableStyle(style))
-        w, h = table.wrap(0, 0)
-        table.drawOn(c, margin, table_start_y - h)
+        draw_table(c, table_data, col_widths, style, margin, table_start_y)
         c.showPage()
     c.save()
 
@@ -275,13 +553,12 @@ def draw_bill_pdf(pdf_buffer, consignor, route, week_range, shipments, summary):
     from reportlab.lib.pagesizes import A4
     from reportlab.lib.units import mm
     from reportlab.pdfgen import canvas
-    from reportlab.platypus import Table, TableStyle
     from reportlab.lib import colors
 
     # Unicode rupee symbol (works even with Helvetica)
     rupee = "Rs"
 
-    c = canvas.Canvas(pdf_buffer, pagesize=A4)
+    c = canvas.Canvas(pdf_buffer, pagesize=A4, invariant=PDF_INVARIANT)
     pw, ph = A4
     margin = 15 * mm
 
@@ -345,10 +622,9 @@ def draw_bill_pdf(pdf_buffer, consignor, route, week_range, shipments, summary):
 
     # Column widths
     col_widths = [60, 90, 80, 100, 60, 90]
-    table = Table(table_data, colWidths=col_widths)
 
     # TABLE STYLE
-    table.setStyle(TableStyle([
+    style = [
         ('BACKGROUND', (0,0), (-1,0), colors.HexColor('#003366')),
         ('TEXTCOLOR', (0,0), (-1,0), colors.white),
         ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
@@ -376,11 +652,10 @@ def draw_bill_pdf(pdf_buffer, consignor, route, week_range, shipments, summary):
         ('ALIGN', (5,1), (5,-1), 'RIGHT'),
 
         ('GRID', (0,0), (-1,-1), 0.8, colors.black),
-    ]))
+    ]
 
     # Draw table
-    w, h = table.wrap(0, 0)
-    table.drawOn(c, margin, table_start_y - h)
+    draw_table(c, table_data, col_widths, style, margin, table_start_y)
 
     c.showPage()
     c.save()
@@ -393,10 +668,9 @@ def draw_ledger_pdf(pdf_buffer, consignor, route, week_range, shipments, summary
     from reportlab.lib.pagesizes import A4
     from reportlab.lib.units import mm
     from reportlab.pdfgen import canvas
-    from reportlab.platypus import Table, TableStyle
     from reportlab.lib import colors
 
-    c = canvas.Canvas(pdf_buffer, pagesize=A4)
+    c = canvas.Canvas(pdf_buffer, pagesize=A4, invariant=PDF_INVARIANT)
     pw, ph = A4
     margin = 15 * mm
 
@@ -440,9 +714,7 @@ def draw_ledger_pdf(pdf_buffer, consignor, route, week_range, shipments, summary
 
     col_widths = [35, 140, 60, 60, 80, 50, 80]
 
-    table = Table(table_data, colWidths=col_widths)
-
-    table.setStyle(TableStyle([
+    style = [
         ('BACKGROUND', (0,0), (-1,0), colors.HexColor('#4472C4')),
         ('TEXTCOLOR', (0,0), (-1,0), colors.white),
         ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
@@ -458,266 +730,1502 @@ def draw_ledger_pdf(pdf_buffer, consignor, route, week_range, shipments, summary
         ('ALIGN', (6,1), (6,-1), 'RIGHT'),
 
         ('GRID', (0,0), (-1,-1), 0.8, colors.black),
-    ]))
+    ]
 
-    w, h = table.wrap(0, 0)
-    table.drawOn(c, margin, table_start_y - h)
+    draw_table(c, table_data, col_widths, style, margin, table_start_y)
 
     c.showPage()
     c.save()
 
+EXCEL_MAX_ROWS = 1048576  # rows Excel opens per worksheet, header included
+
+def write_workbook(excel_buffer, sheets):
+    """Writes (sheet name, header, rows) sheets as an .xlsx file, streaming each row out as
+    it comes so memory stays flat however many rows there are: with xlsxwriter's
+    constant_memory mode when it is installed, else openpyxl's write-only mode. Rows beyond
+    EXCEL_MAX_ROWS continue on "<name> (2)", "<name> (3)", ... sheets under the same header."""
+    try:
+        import xlsxwriter
+    except ImportError:
+        xlsxwriter = None
+    if xlsxwriter is not None:
+        workbook = xlsxwriter.Workbook(excel_buffer, {"constant_memory": True, "nan_inf_to_errors": True})
+        bold = workbook.add_format({"bold": True})
+
+        def add_sheet(name, header):
+            sheet = workbook.add_worksheet(name)
+            sheet.write_row(0, 0, header, bold)
+            row_numbers = itertools.count(1)
+            return lambda row: sheet.write_row(next(row_numbers), 0, row)
+
+        _write_sheets(sheets, add_sheet)
+        workbook.close()
+        return
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font
+    workbook = Workbook(write_only=True)
+
+    def add_sheet(name, header):
+        sheet = workbook.create_sheet(name)
+        header_cells = [WriteOnlyCell(sheet, value=title) for title in header]
+        for cell in header_cells: cell.font = Font(bold=True)
+        sheet.append(header_cells)
+        return sheet.append
+
+    _write_sheets(sheets, add_sheet)
+    workbook.save(excel_buffer)
+
+def _write_sheets(sheets, add_sheet):
+    """Feeds each sheet's rows to the append(row) that add_sheet(name, header) returns for
+    a new sheet, starting the next "<name> (n)" sheet whenever one is full."""
+    for name, header, rows in sheets:
+        append, part, row_count = add_sheet(name, header), 1, 1
+        for row in rows:
+            if row_count == EXCEL_MAX_ROWS:
+                part += 1
+                append, row_count = add_sheet(f"{name} ({part})", header), 1
+            append(row)
+            row_count += 1
+
+LEDGER_SHIPMENT_COLUMNS = ["date", "consignee", "wt", "pkgs", "amount"]
+
+LEDGER_SUMMARY_COLUMNS = ["Week Range", "Consignor", "Route", "Total Trips", "Total Weight (KG)",
+                          "Total Packages", "Total Amount (₹)", "Total Hire (₹)", "Net Amount (₹)",
+                          "Previous Outstanding (₹)", "Final Balance (₹)"]
+
+def ledger_summary_row(consignor, route, week_range, summary):
+    """One weekly ledger's Summary sheet row, in LEDGER_SUMMARY_COLUMNS order."""
+    return [week_range, consignor, route] + [summary[key] for key in (
+        "total_trips", "total_wt", "total_pkgs", "total_amount", "total_hire", "net_amount",
+        "previous_balance", "final_balance")]
+
+def write_ledger_excel(excel_buffer, consignor, route, week_range, shipments, summary):
+    """Shipments and Summary sheets of one weekly ledger, same arguments as the PDFs."""
+    write_workbook(excel_buffer, [
+        ("Shipments", LEDGER_SHIPMENT_COLUMNS,
+         ([shipment[key] for key in LEDGER_SHIPMENT_COLUMNS] for shipment in shipments)),
+        ("Summary", LEDGER_SUMMARY_COLUMNS, [ledger_summary_row(consignor, route, week_range, summary)]),
+    ])
+
+def write_ledger_workbook(excel_buffer, ledgers):
+    """Many weekly ledgers, each given as write_ledger_excel's arguments after the buffer,
+    in one workbook: a Shipments sheet with every ledger's shipments stacked one after
+    another, led by the ledger's consignor, week and route (continued on "Shipments (2)"
+    and on once Excel's row limit is reached), and a Summary sheet with a row per ledger."""
+    write_workbook(excel_buffer, [
+        ("Shipments", ["Consignor", "Week Range", "Route"] + LEDGER_SHIPMENT_COLUMNS,
+         ([consignor, week_range, route] + [shipment[key] for key in LEDGER_SHIPMENT_COLUMNS]
+          for consignor, route, week_range, shipments, _ in ledgers for shipment in shipments)),
+        ("Summary", LEDGER_SUMMARY_COLUMNS,
+         (ledger_summary_row(consignor, route, week_range, summary)
+          for consignor, route, week_range, _, summary in ledgers)),
+    ])
+
+
+# --- Shipment Schema ---
+
+# Every expected column: its canonical header, how it is typed and, when it differs from
+# the header, the column the typed values are stored under. Sheets missing a required
+# column are rejected. Numbers stay float64: challan and summary totals are printed to
+# the paisa/kg, which float32 sums cannot guarantee; the memory saving comes from storing
+# text as category and dropping the raw string columns.
+SHIPMENT_SCHEMA = [
+    {"column": "S. NO.", "kind": "label"},
+    {"column": "DATE", "kind": "date"},
+    {"column": "FROM", "kind": "city"},
+    {"column": "TO", "kind": "city"},
+    {"column": "TRUCK NO.", "kind": "label", "required": False},
+    {"column": "NAME OF THE DRIVER", "kind": "driver"},
+    {"column": "DRIVER MOB. NO.", "kind": "label", "required": False},
+    {"column": "CONSIGNOR", "kind": "consignor"},
+    {"column": "CONSIGNEE", "kind": "label"},
+    {"column": "WT. Kgs.", "kind": "number", "store_as": "WT"},
+    {"column": "NO. OF Pkgs", "kind": "number", "store_as": "PKGS"},
+    {"column": "FREIGHT", "kind": "number"},
+    {"column": "AMOUNT", "kind": "number"},
+    {"column": "Hire", "kind": "number"},
+]
+NUMBER_DTYPE = "float64"
+
+REQUIRED_COLUMNS = [spec["column"] for spec in SHIPMENT_SCHEMA if spec.get("required", True)]
+# All the Party Summary tab reads
+PARTY_SUMMARY_COLUMNS = ["CONSIGNOR", "WT. Kgs.", "FREIGHT", "AMOUNT"]
+
+def _header_key(header):
+    # "S.NO", "s. no." and "S NO." all mean S. NO.
+    return "".join(ch for ch in str(header).upper() if ch.isalnum())
+
+SCHEMA_HEADERS = {_header_key(spec["column"]): spec["column"] for spec in SHIPMENT_SCHEMA}
+
+def normalize_headers(columns):
+    """Maps headers onto the schema's canonical names (ignoring case, spaces and
+    punctuation). Returns (names, renamed) where renamed lists the headers changed."""
+    names, renamed, seen = [], {}, set()
+    for i, header in enumerate(columns):
+        name = str(header).strip() if header is not None else f"Unnamed: {i}"
+        canonical = SCHEMA_HEADERS.get(_header_key(name))
+        if canonical and canonical not in seen:
+            if name != canonical: renamed[name] = canonical
+            name = canonical
+        seen.add(name)
+        names.append(name)
+    return names, renamed
+
+def missing_columns(columns, required=None):
+    """Columns of `required` (default REQUIRED_COLUMNS) that are not in columns."""
+    return [c for c in (REQUIRED_COLUMNS if required is None else required) if c not in columns]
+
+def _to_number(values, dtype=NUMBER_DTYPE):
+    """Vectorized clean_num: blanks and non-numeric text become 0. Also returns how many
+    non-blank cells were not numbers."""
+    text = pd.Series(values, dtype=object).str.strip()
+    numbers = pd.to_numeric(text, errors="coerce")
+    invalid = numbers.isna() & text.notna() & ~text.str.lower().isin(["", "nan"])
+    return numbers.fillna(0).astype(dtype), int(invalid.sum())
+
+SCHEMA_CLEANERS = {
+    "city": clean_city_column,
+    "driver": clean_driver_column,
+    "consignor": clean_consignor_column,
+    "label": lambda values: values.astype("category"),
+}
+
+def apply_schema(df):
+    """Types a raw all-text sheet in one pass: only schema columns are kept, dates parsed,
+    numbers coerced and text stored as category. Returns (df, report)."""
+    typed, report = {}, {"date_counts": {}, "invalid_numbers": {}}
+    for spec in SHIPMENT_SCHEMA:
+        col = spec["column"]
+        if col not in df.columns: continue
+        target = spec.get("store_as", col)
+        if spec["kind"] == "date":
+            typed[target], report["date_counts"] = parse_date_column(df[col])
+        elif spec["kind"] == "number":
+            typed[target], invalid = _to_number(df[col], spec.get("dtype", NUMBER_DTYPE))
+            if invalid: report["invalid_numbers"][target] = invalid
+        else:
+            typed[target] = SCHEMA_CLEANERS[spec["kind"]](df[col])
+    return pd.DataFrame(typed, index=df.index), report
+
+# --- Shipment Loading (parsed once per upload) ---
+
+# Cleaned workbooks kept in memory; least recently used ones are evicted first
+SHIPMENTS_CACHE_ENTRIES = 8
+# Processes used to parse a multi-sheet workbook (1 = parse sheets in this process)
+SHEET_WORKERS = min(4, os.cpu_count() or 1)
+
+def read_upload(uploaded_file):
+    """Raw bytes of a Streamlit upload or of a file path."""
+    if hasattr(uploaded_file, "getvalue"): return uploaded_file.getvalue()
+    with open(uploaded_file, "rb") as f: return f.read()
+
+def upload_name(uploaded_file):
+    return getattr(uploaded_file, "name", None) or os.path.basename(str(uploaded_file))
+
+def _prepare_sheet(sheet_name, df, required=None):
+    """Validates and types one raw sheet: (sheet_name, df or None, report, error). The
+    sheet needs the `required` columns (default REQUIRED_COLUMNS)."""
+    df.columns, renamed = normalize_headers(df.columns)
+    missing = missing_columns(df.columns, required)
+    if missing: return sheet_name, None, {}, f"missing columns: {', '.join(missing)}"
+    df, report = apply_schema(df)
+    if renamed: report["renamed_headers"] = {sheet_name: renamed}
+    return sheet_name, df, report, None
+
+def _parse_sheet(content, sheet_name, required=None):
+    """Reads, validates and types one sheet. Runs in a worker process, so errors are
+    returned rather than raised."""
+    try:
+        return _prepare_sheet(sheet_name, pd.read_excel(io.BytesIO(content), sheet_name, dtype=str), required)
+    except Exception as e:
+        return sheet_name, None, {}, str(e)
+
+# Delimited text uploads: extension -> separator
+DELIMITED_TYPES = {"csv": ",", "tsv": "\t"}
+UPLOAD_TYPES = ["xlsx", "xls"] + list(DELIMITED_TYPES)
+
+def delimiter_for(name):
+    """Separator for a CSV/TSV file name, or None for Excel workbooks."""
+    return DELIMITED_TYPES.get(os.path.splitext(str(name))[1].lower().lstrip("."))
+
+def _read_delimited(content, sep, **kwargs):
+    # C parser with every column as text, so values reach apply_schema exactly as
+    # read_excel(dtype=str) would hand them over (the pyarrow engine re-formats numbers)
+    try:
+        content.decode("utf-8")
+        encoding = "utf-8-sig"
+    except UnicodeDecodeError:
+        encoding = "latin-1"
+    return pd.read_csv(io.BytesIO(content), sep=sep, dtype=str, engine="c", encoding=encoding, **kwargs)
+
+def _parse_delimited(content, sep, required=None):
+    try:
+        return _prepare_sheet("CSV", _read_delimited(content, sep), required)
+    except Exception as e:
+        return "CSV", None, {}, str(e)
+
+def _parse_sheets(content, sheet_names, workers, required=None):
+    if workers > 1 and len(sheet_names) > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=min(workers, len(sheet_names))) as pool:
+                return list(pool.map(_parse_sheet, [content] * len(sheet_names), sheet_names,
+                                     [required] * len(sheet_names)))
+        except Exception:
+            pass  # pool unavailable (e.g. no fork); parse in this process instead
+    return [_parse_sheet(content, s, required) for s in sheet_names]
+
+def _merge_report(report, part_report):
+    for key, counts in part_report.items():
+        merged = report.setdefault(key, {})
+        for name, value in counts.items():
+            merged[name] = {**merged.get(name, {}), **value} if isinstance(value, dict) else merged.get(name, 0) + value
+
+def _combine_parts(parts):
+    """Concatenates typed frames in order into (df, report). Categories differ per part,
+    so categorical columns are re-unified into one sorted set for groupby."""
+    frames = []
+    report = {"date_counts": {}, "invalid_numbers": {}, "renamed_headers": {}, "sheet_errors": {}}
+    for sheet_name, df, part_report, error in parts:
+        if error:
+            report["sheet_errors"][sheet_name] = error
+            continue
+        if df is not None: frames.append(df)
+        _merge_report(report, part_report)
+    if not frames:
+        raise ValueError("No usable sheets: " + "; ".join(f"{s}: {e}" for s, e in report["sheet_errors"].items()))
+    df = pd.concat(frames, ignore_index=True)
+    for col in df.columns:
+        if any(col in f and isinstance(f[col].dtype, pd.CategoricalDtype) for f in frames):
+            df[col] = df[col].astype("category")
+    return df, report
+
+# Streaming mode: rows per typed chunk
+STREAM_CHUNK_ROWS = 20000
+
+# Text read_excel and read_csv turn into missing values by default (their na_values)
+DEFAULT_NA_STRINGS = frozenset([
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null"])
+
+def _cell_to_str(value):
+    # Same text read_excel(dtype=str) produces for an openpyxl cell value
+    if value is None or (isinstance(value, str) and value in DEFAULT_NA_STRINGS): return None
+    if isinstance(value, float) and value.is_integer(): return str(int(value))
+    return str(value)
+
+def iter_shipment_chunks(content, chunk_size=STREAM_CHUNK_ROWS, required=None):
+    """Yields (sheet_name, chunk_df, report, error) with at most chunk_size typed rows per
+    chunk, using openpyxl read-only iteration so the raw workbook is never fully in
+    memory. A sheet failing header validation yields a single (sheet_name, None, {}, error)."""
+    from openpyxl import load_workbook
+    wb = load_workbook(io.BytesIO(content), read_only=True, data_only=True)
+    try:
+        for ws in wb.worksheets:
+            rows = ws.iter_rows(values_only=True)
+            columns, renamed = normalize_headers(next(rows, None) or ())
+            missing = missing_columns(columns, required)
+            if missing:
+                yield ws.title, None, {}, f"missing columns: {', '.join(missing)}"
+                continue
+            batch = []
+            for row in rows:
+                if all(v is None for v in row): continue
+                batch.append([_cell_to_str(v) for v in row[:len(columns)]])
+                if len(batch) == chunk_size:
+                    yield _prepare_sheet(ws.title, pd.DataFrame(batch, columns=columns, dtype=object), required)
+                    batch = []
+            if batch:
+                yield _prepare_sheet(ws.title, pd.DataFrame(batch, columns=columns, dtype=object), required)
+            if renamed: yield ws.title, None, {"renamed_headers": {ws.title: renamed}}, None
+    finally:
+        wb.close()
+
+def iter_delimited_chunks(content, sep, chunk_size=STREAM_CHUNK_ROWS, required=None):
+    """Same contract as iter_shipment_chunks for CSV/TSV content."""
+    try:
+        for chunk in _read_delimited(content, sep, chunksize=chunk_size):
+            part = _prepare_sheet("CSV", chunk, required)
+            yield part
+            if part[3]: return
+    except Exception as e:
+        yield "CSV", None, {}, str(e)
+
+# --- Columnar Snapshots (cleaned shipments persisted as Parquet) ---
+
+SNAPSHOT_DIR = os.environ.get("CHALLAN_SNAPSHOT_DIR", ".challan_snapshots")
+
+def _snapshot_paths(content_hash):
+    base = os.path.join(SNAPSHOT_DIR, content_hash)
+    return base + ".parquet", base + ".json"
+
+def snapshot_version():
+    """Hash of the code and tables that shape a cleaned frame (this module's source,
+    SHIPMENT_SCHEMA, CITY_ALIASES and DRIVER_NA_VALUES); snapshots saved under another
+    version are stale."""
+    h = hashlib.sha256(_code_digest().encode())
+    h.update(json.dumps([SHIPMENT_SCHEMA, CITY_ALIASES, DRIVER_NA_VALUES], sort_keys=True).encode())
+    return h.hexdigest()
+
+def load_snapshot(content_hash):
+    """(df, report) from the stored snapshot of a file, read memory-mapped, or None
+    when there is no usable snapshot (including one saved under another snapshot_version)."""
+    data_path, meta_path = _snapshot_paths(content_hash)
+    if not (os.path.exists(data_path) and os.path.exists(meta_path)): return None
+    try:
+        import pyarrow.parquet as pq
+        with open(meta_path) as f: meta = json.load(f)
+        if meta.get("version") != snapshot_version(): return None
+        df = pq.read_table(data_path, memory_map=True).to_pandas()
+        os.utime(meta_path)  # marks the snapshot as recently used for pruning
+    except Exception:
+        return None
+    return df, meta["report"]
+
+def save_snapshot(content_hash, df, report, source_name=""):
+    data_path, meta_path = _snapshot_paths(content_hash)
+    try:
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        df.to_parquet(data_path + ".tmp", index=False)
+        os.replace(data_path + ".tmp", data_path)
+        meta = {"source": source_name, "rows": len(df), "version": snapshot_version(),
+                "created": datetime.now().isoformat(timespec="seconds"), "report": report}
+        with open(meta_path, "w") as f: json.dump(meta, f)
+    except Exception:
+        pass  # snapshots are an optimization; generation works without them
+
+def list_snapshots():
+    """Stored snapshots, most recently used first."""
+    snapshots = []
+    if not os.path.isdir(SNAPSHOT_DIR): return snapshots
+    for name in os.listdir(SNAPSHOT_DIR):
+        if not name.endswith(".json"): continue
+        content_hash = name[:-len(".json")]
+        data_path, meta_path = _snapshot_paths(content_hash)
+        try:
+            with open(meta_path) as f: meta = json.load(f)
+            size = os.path.getsize(data_path)
+        except Exception:
+            continue
+        snapshots.append({
+            "hash": content_hash[:12],
+            "source": meta.get("source", ""),
+            "rows": meta.get("rows", 0),
+            "size_kb": round(size / 1024, 1),
+            "created": meta.get("created", ""),
+            "last_used": datetime.fromtimestamp(os.path.getmtime(meta_path)).isoformat(timespec="seconds"),
+            "content_hash": content_hash,
+        })
+    snapshots.sort(key=lambda s: s["last_used"], reverse=True)
+    return snapshots
+
+def prune_snapshots(max_age_days=None, keep_latest=None):
+    """Deletes snapshots unused for more than max_age_days and/or beyond the keep_latest
+    most recently used. Returns the number removed."""
+    removed = 0
+    cutoff = datetime.now() - pd.Timedelta(days=max_age_days) if max_age_days is not None else None
+    for i, snap in enumerate(list_snapshots()):
+        too_old = cutoff is not None and datetime.fromisoformat(snap["last_used"]) < cutoff
+        over_limit = keep_latest is not None and i >= keep_latest
+        if not (too_old or over_limit): continue
+        for path in _snapshot_paths(snap["content_hash"]):
+            if os.path.exists(path): os.remove(path)
+        removed += 1
+    return removed
+
+@st.cache_data(max_entries=SHIPMENTS_CACHE_ENTRIES, show_spinner=False)
+def _load_shipments_cached(content_hash, chunk_size, required, _content, _workers, _snapshots, _source_name):
+    # Sheets accepted under other required columns are a different frame, so they get
+    # their own snapshot
+    snapshot_key = content_hash if required is None else \
+        f"{content_hash}-{hashlib.sha256(json.dumps(required).encode()).hexdigest()[:8]}"
+    if _snapshots:
+        snapshot = load_snapshot(snapshot_key)
+        if snapshot is not None: return snapshot
+    sep = delimiter_for(_source_name)
+    if sep and chunk_size:
+        parts = iter_delimited_chunks(_content, sep, chunk_size, required)
+    elif sep:
+        parts = [_parse_delimited(_content, sep, required)]
+    elif chunk_size:
+        parts = iter_shipment_chunks(_content, chunk_size, required)
+    else:
+        parts = _parse_sheets(_content, pd.ExcelFile(io.BytesIO(_content)).sheet_names, _workers, required)
+    df, report = _combine_parts(parts)
+    if _snapshots: save_snapshot(snapshot_key, df, report, _source_name)
+    return df, report
+
+def load_shipments(uploaded_file, chunk_size=None, workers=SHEET_WORKERS, snapshots=True,
+                   required_columns=None):
+    """Returns (df, report) for an upload, where report holds the per-format date counts
+    and the sheets skipped by validation. The workbook is read and cleaned once per
+    distinct content hash; every caller gets its own copy of the cached frame.
+    Sheets are parsed in up to `workers` processes; with chunk_size, .xlsx and CSV/TSV
+    files are instead streamed in cleaned chunks of that many rows. With snapshots, a file seen
+    before is loaded from its Parquet snapshot instead of the spreadsheet. Sheets without
+    every one of required_columns (default REQUIRED_COLUMNS, what the challan and ledger
+    pipelines need) are skipped; the schema columns they do have are still typed."""
+    content = read_upload(uploaded_file)
+    content_hash = hashlib.sha256(content).hexdigest()
+    name = upload_name(uploaded_file)
+    streamable = content[:2] == b"PK" or delimiter_for(name)
+    stream_rows = chunk_size if chunk_size and streamable else None
+    required = None if required_columns is None or list(required_columns) == REQUIRED_COLUMNS \
+        else tuple(required_columns)
+    return _load_shipments_cached(content_hash, stream_rows, required, content, workers, snapshots, name)
+
+def load_report_lines(report):
+    """(level, message) pairs describing a load report; level is "info" or "warning"."""
+    lines = [("info", f"📅 Date formats matched: {format_date_counts(report['date_counts'])}")]
+    for sheet_name, renamed in report.get("renamed_headers", {}).items():
+        lines.append(("info", f"🔤 Sheet '{sheet_name}' headers normalized: "
+                      + ", ".join(f"'{old}' → '{new}'" for old, new in renamed.items())))
+    if report.get("invalid_numbers"):
+        lines.append(("warning", "⚠️ Non-numeric values counted as 0: "
+                      + ", ".join(f"{col}: {n}" for col, n in report["invalid_numbers"].items())))
+    for sheet_name, error in report["sheet_errors"].items():
+        lines.append(("warning", f"⚠️ Sheet '{sheet_name}' skipped: {error}"))
+    return lines
+
+def show_load_report(report):
+    for level, message in load_report_lines(report):
+        st.warning(message) if level == "warning" else st.caption(message)
+
+# --- Incremental Generation (challan fingerprints) ---
+
+FINGERPRINT_STORE = os.environ.get("CHALLAN_FINGERPRINT_STORE", ".challan_fingerprints.json")
+# Row contents that end up on a challan; any change re-renders it
+FINGERPRINT_COLUMNS = ["CONSIGNOR", "CONSIGNEE", "WT", "PKGS", "FREIGHT", "AMOUNT", "Hire",
+                       "TRUCK NO.", "DRIVER MOB. NO."]
+
+def load_fingerprints():
+    """Challan identity -> fingerprint from earlier runs."""
+    try:
+        with open(FINGERPRINT_STORE) as f: return json.load(f)
+    except Exception:
+        return {}
+
+def save_fingerprints(fingerprints):
+    stored = load_fingerprints()
+    stored.update(fingerprints)
+    try:
+        with open(FINGERPRINT_STORE + ".tmp", "w") as f: json.dump(stored, f)
+        os.replace(FINGERPRINT_STORE + ".tmp", FINGERPRINT_STORE)
+    except OSError:
+        pass  # without history the next run simply renders everything
+
+def forget_fingerprints():
+    if os.path.exists(FINGERPRINT_STORE): os.remove(FINGERPRINT_STORE)
+
+def challan_identity(serial_no, date, driver, route_from, route_to):
+    day = date.strftime("%Y-%m-%d") if not pd.isna(date) else ""
+    return f"{serial_no}|{day}|{driver}|{route_from}|{route_to}"
+
+def challan_fingerprint(group_row_hashes, hamali):
+    """Hash of a challan's rows (in order) plus the hamali settings of its route."""
+    h = hashlib.sha256(group_row_hashes.tobytes())
+    h.update(json.dumps(hamali, sort_keys=True).encode())
+    return h.hexdigest()[:32]
+
+def book_fingerprint(challan_fingerprints, bookmarks):
+    """Hash of a consolidated PDF's challans (their fingerprints, in page order) and whether
+    it carries bookmarks."""
+    h = hashlib.sha256("|".join(challan_fingerprints).encode())
+    h.update(b"bookmarks" if bookmarks else b"")
+    return h.hexdigest()[:32]
+
+# --- Run Instrumentation (stage timings and progress) ---
+
+PROGRESS_INTERVAL = 0.5  # seconds between progress updates sent to the browser
+
+def new_run_stats(pipeline):
+    return {"pipeline": pipeline, "started": datetime.now().isoformat(timespec="seconds"), "stages": {}}
+
+MEMORY_SAMPLE_INTERVAL = 0.05  # seconds between resident memory samples while a stage runs
+_memory_watch = {"stages": [], "thread": None, "wake": threading.Condition()}
+
+def _rss_mb(pid="self"):
+    """Resident memory of a process in MB from /proc, or None where that is unavailable."""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+def _workers_rss_mb():
+    """Resident memory of this process's child processes (the render and sheet workers)
+    together in MB, or None where /proc is unavailable."""
+    try:
+        pids = set()
+        for task in os.listdir("/proc/self/task"):
+            with open(f"/proc/self/task/{task}/children") as f: pids.update(f.read().split())
+    except OSError:
+        return None
+    return sum(filter(None, (_rss_mb(pid) for pid in pids)))
+
+def _track_peak(peak, key, value):
+    if value is not None and (peak[key] is None or value > peak[key]): peak[key] = value
+
+def _sample_memory():
+    """Background loop recording the memory of this process and its workers into the
+    peaks of every stage being timed, every MEMORY_SAMPLE_INTERVAL seconds."""
+    wake = _memory_watch["wake"]
+    while True:
+        with wake:
+            while not _memory_watch["stages"]: wake.wait()
+            peaks = list(_memory_watch["stages"])
+        rss, workers = _rss_mb(), _workers_rss_mb()
+        for peak in peaks:
+            _track_peak(peak, "rss", rss)
+            _track_peak(peak, "workers", workers)
+        time.sleep(MEMORY_SAMPLE_INTERVAL)
+
+@contextlib.contextmanager
+def memory_peak():
+    """Yields a dict whose "rss" and "workers" become the peak resident memory (MB) of this
+    process and of its worker processes while the block runs, sampled in the background;
+    they stay None where /proc is unavailable. Unlike ru_maxrss, which only ever grows over
+    the process's lifetime, this is the peak of the block alone."""
+    peak = {"rss": None, "workers": None}
+    _track_peak(peak, "rss", _rss_mb())
+    wake = _memory_watch["wake"]
+    with wake:
+        if _memory_watch["thread"] is None:
+            _memory_watch["thread"] = threading.Thread(target=_sample_memory, daemon=True)
+            _memory_watch["thread"].start()
+        _memory_watch["stages"].append(peak)
+        wake.notify()
+    try:
+        yield peak
+    finally:
+        with wake:
+            _memory_watch["stages"].remove(peak)
+        _track_peak(peak, "rss", _rss_mb())
+
+@contextlib.contextmanager
+def timed_stage(run_stats, name):
+    """Adds the block's wall and CPU seconds (including worker processes that finished
+    during it) to stage `name` of run_stats, summing over repeated blocks, and records the
+    peak memory of this process and its workers during the stage (see memory_peak). Yields the stage's dict so the block can count the "docs"
+    and "bytes" it produced. Without run_stats nothing is recorded."""
+    if run_stats is None:
+        yield {"docs": 0, "bytes": 0}
+        return
+    stage = run_stats["stages"].setdefault(name, {"seconds": 0.0, "cpu_seconds": 0.0, "docs": 0, "bytes": 0})
+    start_wall, start_cpu = time.perf_counter(), os.times()
+    try:
+        with memory_peak() as peak:
+            yield stage
+    finally:
+        end_cpu = os.times()
+        stage["seconds"] += time.perf_counter() - start_wall
+        stage["cpu_seconds"] += sum(end_cpu[:4]) - sum(start_cpu[:4])
+        for key, value in (("peak_rss_mb", peak["rss"]), ("workers_peak_rss_mb", peak["workers"])):
+            if value is not None: stage[key] = round(max(value, stage.get(key) or 0.0), 1)
+
+def timed_iter(run_stats, name, items):
+    """Yields from items, timing each step of the iteration as stage `name`, where each
+    item is one document of len() bytes."""
+    items = iter(items)
+    while True:
+        with timed_stage(run_stats, name) as stage:
+            try:
+                item = next(items)
+            except StopIteration:
+                return
+            stage["docs"] += 1
+            stage["bytes"] += len(item)
+        yield item
+
+def stage_table(run_stats):
+    """One row per stage with its rates, for display."""
+    rows = []
+    for name, stage in run_stats["stages"].items():
+        seconds = stage["seconds"]
+        rows.append({"stage": name, "seconds": round(seconds, 3), "cpu_seconds": round(stage["cpu_seconds"], 3),
+                     "docs": stage["docs"], "docs_per_sec": round(stage["docs"] / seconds, 1) if seconds else None,
+                     "mb": round(stage["bytes"] / 1024 / 1024, 2), "peak_rss_mb": stage.get("peak_rss_mb"),
+                     "workers_peak_rss_mb": stage.get("workers_peak_rss_mb")})
+    return rows
+
+def progress_reporter(show, total, label, run_stats=None, interval=None):
+    """report(done) callback (also usable as render_pdfs' on_progress) for `total` items.
+    Calls show(fraction, text) with the rate and an ETA at most every `interval` seconds
+    (default PROGRESS_INTERVAL) and for the last item; the latest figures are also kept
+    in run_stats["progress"]."""
+    if interval is None: interval = PROGRESS_INTERVAL
+    started = time.perf_counter()
+    last_shown = [None]
+
+    def report(done, _total=None):
+        now = time.perf_counter()
+        if done < total and last_shown[0] is not None and now - last_shown[0] < interval: return
+        last_shown[0] = now
+        rate = done / (now - started) if now > started else 0.0
+        eta = (total - done) / rate if rate else None
+        if run_stats is not None:
+            run_stats["progress"] = {"label": label, "done": done, "total": total,
+                                     "per_sec": round(rate, 1), "eta_seconds": eta and round(eta, 1)}
+        eta_text = f"ETA {eta:.0f}s" if eta is not None else "ETA --"
+        show(done / total if total else 1.0, f"{label} {done}/{total} · {rate:.0f}/s · {eta_text}")
+
+    return report
+
+def streamlit_progress():
+    """show(fraction, text) drawing onto a progress bar and status line in the page."""
+    progress_bar = st.progress(0)
+    status_text = st.empty()
+
+    def show(fraction, text):
+        progress_bar.progress(min(fraction, 1.0))
+        status_text.text(text)
+
+    return show
+
+RUN_STATS_REFRESH = 1.0  # seconds between refreshes of the timings while a download renders
+
+def run_stats_status(run_stats):
+    """Line describing the render a download performs after planning while it is pending
+    or in progress (with its rate and ETA); None once it is done or for runs without one."""
+    status = run_stats.get("render_status", "pending")
+    progress = run_stats.get("progress") or {}
+    if status == "pending":
+        return "⏳ Render and package pending: they run when the full ZIP is downloaded"
+    if status == "running" and progress:
+        eta = progress.get("eta_seconds")
+        return (f"🔄 {progress['label']} {progress['done']}/{progress['total']} · "
+                f"{progress['per_sec']:.0f}/s · ETA {f'{eta:.0f}s' if eta is not None else '--'}")
+    if status == "running":
+        return "🔄 Rendering..."
+    return None
+
+def show_run_stats(run_stats, deferred=False):
+    """Collapsible stage timings of a run, with a JSON export. With `deferred`, the render
+    and package stages are added later by a download (see deferred_archive): until then
+    the panel says so, and it refreshes itself every RUN_STATS_REFRESH seconds, showing
+    the render's progress, until the render is done. The export is disabled while the
+    render is adding to run_stats."""
+    pending = deferred and run_stats.get("render_status") != "done"
+
+    @st.fragment(run_every=RUN_STATS_REFRESH if pending else None)
+    def panel():
+        if pending and run_stats.get("render_status") == "done":
+            st.rerun()  # once more in full, to stop refreshing
+        status = run_stats_status(run_stats) if deferred else None
+        if status:
+            progress = run_stats.get("progress") or {}
+            st.progress(progress["done"] / progress["total"] if progress.get("total") else 0.0, text=status)
+        with st.expander("⏱️ Run Timings"):
+            st.dataframe(pd.DataFrame(stage_table(run_stats)), hide_index=True)
+            running = run_stats.get("render_status") == "running"
+            st.download_button(
+                "📤 Export Timings (JSON)",
+                data="" if running else json.dumps(run_stats, indent=2, default=str),
+                file_name=f"{run_stats['pipeline']}_timings_{run_stats['started'].replace(':', '')}.json",
+                mime="application/json",
+                key=f"run_stats_{run_stats['pipeline']}",
+                disabled=running)
+
+    panel()
+
+# --- PDF Cache (rendered PDFs on disk, keyed by their inputs) ---
+
+PDF_CACHE_DIR = os.environ.get("CHALLAN_PDF_CACHE_DIR", ".challan_pdf_cache")
+PDF_CACHE_BYTES = int(os.environ.get("CHALLAN_PDF_CACHE_MB", 512)) * 1024 * 1024
+
+@functools.lru_cache(maxsize=None)
+def _code_digest():
+    """Hash of this module's source, so a change to any drawing code misses the cache."""
+    try:
+        with open(__file__, "rb") as f: return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return ""
+
+def pdf_cache_key(kind, args):
+    h = hashlib.sha256(_code_digest().encode())
+    h.update(json.dumps([kind, TABLE_RENDERER, args], sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+def _cache_path(key):
+    return os.path.join(PDF_CACHE_DIR, key[:2], key + ".pdf")
+
+def cache_get(key):
+    path = _cache_path(key)
+    try:
+        with open(path, "rb") as f: pdf = f.read()
+        os.utime(path)  # marks the PDF as recently used for eviction
+    except OSError:
+        return None
+    return pdf
+
+def cache_put(key, pdf):
+    path = _cache_path(key)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp, "wb") as f: f.write(pdf)
+        os.replace(tmp, path)
+    except OSError:
+        pass  # the cache is an optimization; rendering works without it
+
+def new_cache_stats():
+    return {"hits": 0, "misses": 0, "evicted": 0}
+
+def render_cached(kind, args, cache_stats):
+    """PDF bytes of one job, from the cache when it holds them; counted in cache_stats."""
+    key = pdf_cache_key(kind, args)
+    pdf = cache_get(key)
+    if pdf is not None:
+        cache_stats["hits"] += 1
+        return pdf
+    pdf = _render_job((kind, args))
+    cache_put(key, pdf)
+    cache_stats["misses"] += 1
+    return pdf
+
+def _cache_entries():
+    """(last used, size, path) of every cached PDF."""
+    entries = []
+    if not os.path.isdir(PDF_CACHE_DIR): return entries
+    for shard in os.scandir(PDF_CACHE_DIR):
+        if not shard.is_dir(): continue
+        for entry in os.scandir(shard.path):
+            if not entry.name.endswith(".pdf"): continue
+            try:
+                info = entry.stat()
+            except OSError:
+                continue
+            entries.append((info.st_mtime, info.st_size, entry.path))
+    return entries
+
+def pdf_cache_usage():
+    """(file count, total bytes) of the cache."""
+    entries = _cache_entries()
+    return len(entries), sum(size for _, size, _ in entries)
+
+def evict_pdf_cache(max_bytes=None):
+    """Deletes least recently used PDFs until the cache fits in max_bytes (default
+    PDF_CACHE_BYTES). Returns the number removed."""
+    if max_bytes is None: max_bytes = PDF_CACHE_BYTES
+    entries = sorted(_cache_entries())
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, path in entries:
+        if total <= max_bytes: break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    return removed
+
+def show_cache_stats(cache_stats):
+    if not (cache_stats["hits"] or cache_stats["misses"]): return  # nothing rendered yet
+    st.caption(f"🗃️ PDF cache: {cache_stats['hits']} hit(s), {cache_stats['misses']} rendered, "
+               f"{cache_stats['evicted']} evicted")
+
+# --- PDF Rendering ---
+
+RENDER_WORKERS = os.cpu_count() or 1
+RENDER_AHEAD = 4  # jobs queued per worker beyond the one being rendered
+
+PDF_RENDERERS = {
+    "challan": draw_pdf,
+    "challan_book": draw_challan_book,
+    "summary": draw_summary_pdf,
+    "bill": draw_bill_pdf,
+    "ledger": draw_ledger_pdf,
+}
+
+# Other files rendered from jobs the same way; only PDFs are cached
+DOCUMENT_RENDERERS = {
+    **PDF_RENDERERS,
+    "ledger_excel": write_ledger_excel,
+    "ledger_workbook": write_ledger_workbook,
+}
+
+def _render_job(job):
+    """Renders one (kind, args) job to bytes. Runs in a worker process."""
+    kind, args = job
+    buffer = io.BytesIO()
+    DOCUMENT_RENDERERS[kind](buffer, *args)
+    return buffer.getvalue()
+
+def render_document(job, cache_stats=None):
+    """Bytes of one (kind, args) job, rendered in this process when called; PDFs go
+    through the PDF cache when cache_stats is given."""
+    kind, args = job
+    if cache_stats is None or kind not in PDF_RENDERERS: return _render_job(job)
+    return render_cached(kind, args, cache_stats)
+
+def render_pdfs(jobs, workers=RENDER_WORKERS, on_progress=None, cache_stats=None):
+    """Yields the bytes of each (kind, args) job, in job order. Jobs are rendered in up
+    to `workers` processes, at most RENDER_AHEAD per worker ahead of the next one due, and
+    on_progress(done, total) is called as each finishes, in whatever order that is.
+    With cache_stats (see new_cache_stats), PDFs already in the on-disk cache are read
+    from it instead, new ones are added, and the cache is trimmed to PDF_CACHE_BYTES
+    once the generator finishes or is closed."""
+    if cache_stats is None:
+        yield from _render_all(jobs, workers, on_progress)
+        return
+    total = len(jobs)
+    keys = [pdf_cache_key(kind, args) if kind in PDF_RENDERERS else None for kind, args in jobs]
+    missing = [i for i, key in enumerate(keys) if key is None or not os.path.exists(_cache_path(key))]
+    cached_count = total - len(missing)
+    if on_progress and cached_count: on_progress(cached_count, total)
+    rendered = _render_all([jobs[i] for i in missing], workers,
+                           on_progress and (lambda done, _: on_progress(cached_count + done, total)))
+    missing = set(missing)
+    try:
+        for i, (job, key) in enumerate(zip(jobs, keys)):
+            if i in missing:
+                pdf = next(rendered)
+                if key is not None:
+                    cache_put(key, pdf)
+                    cache_stats["misses"] += 1
+            else:
+                pdf = render_cached(*job, cache_stats)  # renders after all if evicted meanwhile
+            yield pdf
+    finally:  # also when the caller stops iterating right after the last PDF
+        cache_stats["evicted"] += evict_pdf_cache()
+
+def _render_all(jobs, workers, on_progress):
+    total = len(jobs)
+    next_index = 0
+    if workers > 1 and total > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=min(workers, total)) as pool:
+                pending, finished, submitted = {}, {}, 0
+                while next_index < total:
+                    while submitted < total and submitted - next_index < workers * RENDER_AHEAD:
+                        pending[pool.submit(_render_job, jobs[submitted])] = submitted
+                        submitted += 1
+                    ready, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in ready:
+                        finished[pending.pop(future)] = future.result()
+                        if on_progress: on_progress(next_index + len(finished), total)
+                    while next_index in finished:
+                        yield finished.pop(next_index)
+                        next_index += 1
+            return
+        except Exception:
+            pass  # pool unavailable or broken; render what is left in this process
+    for index in range(next_index, total):
+        pdf = _render_job(jobs[index])
+        if on_progress: on_progress(index + 1, total)
+        yield pdf
+
+# --- ZIP Output ---
+
+ZIP_SPOOL_BYTES = 32 * 1024 * 1024  # archives larger than this spill from memory to disk
+_SPOOL_LOCK = threading.Lock()  # deferred downloads read the spool on Streamlit's threads
+
+def spooled_zip_file():
+    """Temporary file for a ZIP being built: in memory while small, on disk once large."""
+    return tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_BYTES)
+
+def read_spooled(spool):
+    """The whole spooled file, e.g. the finished archive for a download."""
+    with _SPOOL_LOCK:
+        spool.seek(0)
+        return spool.read()
+
+def spooled_size(spool):
+    with _SPOOL_LOCK:
+        return spool.seek(0, io.SEEK_END)
+
+def read_member(spool, member):
+    """One member of the archive in `spool`."""
+    with _SPOOL_LOCK, zipfile.ZipFile(spool) as source:
+        return source.read(member)
+
+def zip_compression(store_only=False):
+    """PDFs and .xlsx files are already compressed; storing them skips deflating again."""
+    return zipfile.ZIP_STORED if store_only else zipfile.ZIP_DEFLATED
+
+def _raw_member(source, info):
+    """A member's data exactly as stored in the `source` archive, still compressed."""
+    source.fp.seek(info.header_offset)
+    header = source.fp.read(zipfile.sizeFileHeader)
+    name_len, extra_len = struct.unpack("<HH", header[26:30])
+    source.fp.seek(info.header_offset + zipfile.sizeFileHeader + name_len + extra_len)
+    return source.fp.read(info.compress_size)
+
+def copy_member(source, member, target, name):
+    """Adds `member` of the `source` archive to the `target` archive (open for writing)
+    as `name`, reusing its compressed bytes instead of inflating and deflating again."""
+    info = source.getinfo(member)
+    zinfo = copy.copy(info)
+    zinfo.filename = name
+    zinfo.extra = b""
+    zinfo.flag_bits &= ~0x08  # sizes and CRC are known, so no data descriptor follows
+    zinfo.header_offset = target.fp.tell()
+    target.fp.write(zinfo.FileHeader())
+    target.fp.write(_raw_member(source, info))
+    target.filelist.append(zinfo)
+    target.NameToInfo[name] = zinfo
+    target.start_dir = target.fp.tell()
+
+def subset_zip(spool, entries):
+    """ZIP bytes holding (member, name) entries copied, still compressed, from the archive
+    in `spool`."""
+    buffer = io.BytesIO()
+    with _SPOOL_LOCK, zipfile.ZipFile(spool) as source, zipfile.ZipFile(buffer, "w") as zf:
+        for member, name in entries:
+            copy_member(source, member, zf, name)
+    return buffer.getvalue()
+
+def write_documents(archive, entries, workers=RENDER_WORKERS, cache_stats=None, run_stats=None,
+                    on_progress=None):
+    """Renders the (member, job) entries with render_pdfs and writes each into `archive`,
+    a ZipFile open for writing, as soon as it is ready; timed as the "render" and
+    "package" stages of run_stats."""
+    rendered = timed_iter(run_stats, "render", render_pdfs(
+        [job for _, job in entries], workers, on_progress, cache_stats))
+    for data, (member, _) in zip(rendered, entries):  # rendered first, so it runs to the end
+        with timed_stage(run_stats, "package") as stage:
+            archive.writestr(member, data)
+            stage["docs"] += 1
+            stage["bytes"] += archive.infolist()[-1].compress_size
+
+def save_documents(directory, entries, workers=RENDER_WORKERS, cache_stats=None, run_stats=None,
+                   on_progress=None):
+    """write_documents into a folder: each (path, job) entry becomes the file
+    directory/path, with "/" separating subfolders."""
+    rendered = timed_iter(run_stats, "render", render_pdfs(
+        [job for _, job in entries], workers, on_progress, cache_stats))
+    for data, (path, _) in zip(rendered, entries):
+        with timed_stage(run_stats, "package") as stage:
+            target = os.path.join(directory, *path.split("/"))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, "wb") as f: f.write(data)
+            stage["docs"] += 1
+            stage["bytes"] += len(data)
+
+def challan_entries(month_wise_data):
+    """("<month>/<route>/<file>", job) for every document plan_challan_documents lays out."""
+    return [(f"{month_key}/{route_key}/{fname}", job) for month_key, routes in month_wise_data.items()
+            for route_key, files in routes.items() for fname, job in files]
+
+# "per_ledger": an Excel file next to each bill and ledger PDF; "consignor": one workbook
+# per consignor holding all its weekly ledgers; "run": one workbook for every consignor
+LEDGER_EXCEL_MODES = ["per_ledger", "consignor", "run"]
+RUN_WORKBOOK_NAME = "All_Ledgers.xlsx"
+
+def ledger_workbook_job(weekly_ledgers):
+    """Render job for one write_ledger_workbook of ledger_data entries."""
+    return ("ledger_workbook", ([data["excel"][1][1] for data in weekly_ledgers],))
+
+def ledger_entries(ledger_data, excel_mode="per_ledger"):
+    """consignor -> ("<week range>/<file>", job) for every file of generate_weekly_ledgers(lazy=True),
+    Excel files as excel_mode (one of LEDGER_EXCEL_MODES) says; a consignor's workbook sits
+    beside its week folders. The "run" workbook is left to all_ledger_entries."""
+    entries = {}
+    for consignor, weeks_data in ledger_data.items():
+        weekly_ledgers = [data for routes in weeks_data.values() for data in routes.values()]
+        documents = ("bill_pdf", "ledger_pdf", "excel") if excel_mode == "per_ledger" else ("bill_pdf", "ledger_pdf")
+        entries[consignor] = [(f"{data['week_range']}/{data[document][0]}", data[document][1])
+                              for data in weekly_ledgers for document in documents]
+        if excel_mode == "consignor":
+            entries[consignor].append((f"{consignor}__Ledgers.xlsx", ledger_workbook_job(weekly_ledgers)))
+    return entries
+
+def all_ledger_entries(ledger_data, excel_mode="per_ledger", consignor_entries=None):
+    """("<consignor>/<week range>/<file>", job) for the whole run, plus the run workbook at
+    the top with excel_mode "run". consignor_entries is ledger_entries' result if at hand."""
+    if consignor_entries is None: consignor_entries = ledger_entries(ledger_data, excel_mode)
+    entries = [(f"{consignor}/{name}", job) for consignor, files in consignor_entries.items() for name, job in files]
+    if excel_mode == "run":
+        entries.append((RUN_WORKBOOK_NAME, ledger_workbook_job(
+            [data for weeks_data in ledger_data.values() for routes in weeks_data.values()
+             for data in routes.values()])))
+    return entries
+
+def deferred_archive(entries, store_only=False, workers=RENDER_WORKERS, cache_stats=None,
+                     source=None, prefix="", run_stats=None, on_built=None):
+    """A zero-arg callable for st.download_button's data returning the ZIP of the
+    (name, job) entries, rendered on the first call only (and timed into run_stats); the
+    built archive's spool is kept as its .spool, and on_built() is called once it is
+    complete. Streamlit calls it outside the script run, so its progress goes to
+    run_stats["progress"] and run_stats["render_status"] (see show_run_stats) rather than
+    onto the page. With `source`, another deferred archive holding every entry as prefix +
+    name, entries are copied from it instead once it has been built."""
+    lock = threading.Lock()
+    if run_stats is not None: run_stats.setdefault("render_status", "pending")
+
+    def archive_bytes():
+        if source is not None and source.spool is not None and archive_bytes.spool is None:
+            return subset_zip(source.spool, [(prefix + name, name) for name, _ in entries])
+        with lock:
+            if archive_bytes.spool is None:
+                spool = spooled_zip_file()
+                on_progress = None
+                if run_stats is not None:
+                    run_stats["render_status"] = "running"
+                    on_progress = progress_reporter(lambda fraction, text: None, len(entries),
+                                                    "Rendering", run_stats)
+                with zipfile.ZipFile(spool, "w", zip_compression(store_only)) as zf:
+                    write_documents(zf, entries, workers, cache_stats, run_stats, on_progress)
+                archive_bytes.spool = spool
+                if run_stats is not None: run_stats["render_status"] = "done"
+                if on_built is not None: on_built()
+        return read_spooled(archive_bytes.spool)
+
+    archive_bytes.spool = None
+    return archive_bytes
+
+def deferred_document(job, cache_stats=None, source=None, member=None):
+    """A zero-arg callable for st.download_button's data rendering one job when called,
+    or reading it as `member` from the deferred archive `source` once that is built."""
+    def document_bytes():
+        if source is not None and source.spool is not None:
+            return read_member(source.spool, member)
+        return render_document(job, cache_stats)
+    return document_bytes
+
+# --- Challan Assembly ---
+
+CHALLAN_KEYS = ["S. NO.", "DATE", "NAME OF THE DRIVER", "FROM", "TO"]
+LINE_ITEM_COLUMNS = ["CONSIGNOR", "CONSIGNEE", "WT", "PKGS", "FREIGHT", "AMOUNT"]
+
+def group_slices(grouped, group_count):
+    """(row_order, starts, ends) for a DataFrameGroupBy: row_order[starts[i]:ends[i]] are
+    the positions of group i's rows (in groupby order), in sheet order. Rows with a
+    missing key belong to no group."""
+    group_ids = grouped.ngroup().to_numpy()
+    row_order = np.argsort(group_ids, kind="stable")
+    row_order = row_order[group_ids[row_order] >= 0]
+    starts = np.searchsorted(group_ids[row_order], np.arange(group_count))
+    ends = np.append(starts[1:], len(row_order)).astype(starts.dtype)
+    return row_order, starts, ends
+
+def slice_sums(values, starts, ends):
+    """Sums of values[start:end] per group, values already in group_slices' row order.
+    These are the same numpy reduction a per-group Series.sum does; groupby's compensated
+    sum and np.add.reduceat both differ from it in the last bit, which moves some x.x5
+    totals across a rounding boundary on the printed documents."""
+    return np.array([values[a:b].sum() for a, b in zip(starts, ends)], dtype=values.dtype)
+
+def aggregate_challans(df):
+    """One challan per (serial, date, driver, route) group, built in a single pass.
+    Returns (challans, line_items, row_order): challans has the group keys, the WT/PKGS/
+    AMOUNT totals, the first row's hire, truck and driver mobile, and start/end offsets
+    into line_items (row dicts, grouped, in sheet order). row_order[start:end] are the
+    positions in df of a challan's rows."""
+    grouped = df.groupby(CHALLAN_KEYS, observed=True)
+    challans = grouped.size().reset_index()[CHALLAN_KEYS]
+    row_order, starts, ends = group_slices(grouped, len(challans))
+    for col, field in (("WT", "total_wt"), ("PKGS", "total_pkgs"), ("AMOUNT", "total_amount")):
+        challans[field] = slice_sums(df[col].to_numpy()[row_order], starts, ends)
+    challans["start"] = starts
+    challans["end"] = ends
+    first_rows = row_order[starts]
+    # iloc[0] semantics (a blank first cell stays blank), unlike agg("first")
+    challans["hire"] = df["Hire"].to_numpy()[first_rows]
+    for col, field in (("DRIVER MOB. NO.", "driver_mob"), ("TRUCK NO.", "truck")):
+        challans[field] = df[col].to_numpy()[first_rows] if col in df.columns else "NA"
+    line_items = df[LINE_ITEM_COLUMNS].iloc[row_order].to_dict("records")
+    return challans, line_items, row_order
+
+DEFAULT_HAMALI = {"loading": 1700, "unloading": 1700}  # per route, until set otherwise
+
+def list_routes(df):
+    """Sorted distinct (FROM, TO) pairs with both cities present, as hamali is set per route."""
+    route_pairs = df.loc[(df["FROM"] != "") & (df["TO"] != ""), ["FROM", "TO"]].astype(str)
+    return sorted(route_pairs.drop_duplicates().itertuples(index=False, name=None))
+
+def challan_meta(challan, route_hamali):
+    """Everything draw_pdf prints besides the line items, for one aggregated challan."""
+    date = challan["DATE"]
+    # Back to numpy scalars: round(x, 1) on an np.float64 can land on the other side of
+    # an x.x5 tie than on a Python float, and the printed totals must not change
+    total_wt, total_pkgs, total_amount, hire = (np.float64(challan[k]) for k in
+                                                ("total_wt", "total_pkgs", "total_amount", "hire"))
+    route_key = f"{challan['FROM']}_TO_{challan['TO']}"
+    hamali_loading = route_hamali.get(route_key, {}).get("loading", 0)
+    hamali_unloading = route_hamali.get(route_key, {}).get("unloading", 0)
+    other_exp = 0
+    balance = total_amount - hire - (hamali_loading + hamali_unloading) - other_exp
+    return {
+        "FROM": challan["FROM"],
+        "TO": challan["TO"],
+        "month": date.strftime("%B").upper() if not pd.isna(date) else "",
+        "driver": challan["NAME OF THE DRIVER"],
+        "driver_mob": challan["driver_mob"],
+        "truck": challan["truck"],
+        "challan_no": str(challan["S. NO."]),
+        "date": date.strftime("%d/%m/%Y") if not pd.isna(date) else "",
+        "total_wt": total_wt,
+        "total_pkgs": total_pkgs,
+        "total_amount": total_amount,
+        "hire": hire,
+        "hamali_loading": hamali_loading,
+        "hamali_unloading": hamali_unloading,
+        "other_exp": other_exp,
+        "balance": balance,
+    }
+
+def summarize_routes(challans, route_hamali):
+    """Route summary rows for every (month_key, FROM, TO), from aggregate_challans' challans
+    in one pass. Route-months come in order of their first challan and their rows by date
+    (same-day challans in challan order). Figures stay numbers, already cut to what
+    draw_summary_pdf prints (whole QTY/weight/hire/hamali, topay and balance to 0.1) so
+    its TOTAL row adds up the printed column."""
+    dates = challans["DATE"]
+    route_keys = challans["FROM"].astype(str) + "_TO_" + challans["TO"].astype(str)
+    hamali = route_keys.map({route_key: route_hamali.get(route_key, {}).get("loading", 0)
+                                        + route_hamali.get(route_key, {}).get("unloading", 0)
+                             for route_key in route_keys.unique()})
+    rollup = pd.DataFrame({
+        "month_key": dates.dt.strftime("%B_%Y").fillna("Unknown_Month"),
+        "FROM": challans["FROM"],
+        "TO": challans["TO"],
+        "date": dates,
+        "truck_no": challans["truck"],
+        "challan_no": challans["S. NO."],
+        "qty": np.trunc(challans["total_pkgs"]).astype("int64"),
+        "weight": np.trunc(challans["total_wt"]).astype("int64"),
+        "topay": challans["total_amount"].round(1),
+        "hire": np.trunc(challans["hire"]).astype("int64"),
+        "hamali": np.trunc(hamali.astype("float64")).astype("int64"),
+        # same operations as challan_meta's balance, so both round alike
+        "balance": (challans["total_amount"] - challans["hire"] - hamali).round(1),
+    })
+    summary_keys = ["month_key", "FROM", "TO"]
+    rollup["route_month"] = rollup.groupby(summary_keys, sort=False, observed=True).ngroup()
+    rollup = rollup.sort_values(["route_month", "date"], kind="stable")
+    # One to_dict for all rows, sliced per route-month, instead of one per group
+    records = rollup[["date", "truck_no", "challan_no", "qty", "weight", "topay", "hire", "hamali",
+                      "balance"]].to_dict("records")
+    route_months = rollup["route_month"].to_numpy()
+    keys = rollup.drop_duplicates("route_month")[summary_keys].itertuples(index=False, name=None)
+    starts = np.searchsorted(route_months, np.arange(route_months.max() + 1 if len(route_months) else 0))
+    ends = np.append(starts[1:], len(records))
+    return {key: records[a:b] for key, a, b in zip(keys, starts, ends)}
 
 # --- Main Processing Function (Challans etc.) ---
-def process_excel_file(uploaded_file, route_hamali):    
-    xls = pd.ExcelFile(uploaded_file)
-    df = pd.concat([pd.read_excel(uploaded_file, s, dtype=str) for s in xls.sheet_names], ignore_index=True)
-    df["DATE_RAW"] = df["DATE"]
-    df.columns = [c.strip() for c in df.columns]
-    df["DATE"] = df["DATE"].apply(parse_date_flexible)
-    df["FROM"] = df["FROM"].apply(clean_city)
-    df["TO"] = df["TO"].apply(clean_city)
-    df["CONSIGNOR"] = df["CONSIGNOR"].apply(clean_consignor)
-    df["NAME OF THE DRIVER"] = df["NAME OF THE DRIVER"].apply(clean_driver)
-    df["WT"] = df["WT. Kgs."].apply(clean_num)
-    df["PKGS"] = df["NO. OF Pkgs"].apply(clean_num)
-    df["FREIGHT"] = df["FREIGHT"].apply(clean_num)
-    df["AMOUNT"] = df["AMOUNT"].apply(clean_num)
-    df["Hire"] = df["Hire"].apply(clean_num)
-    
-    groups = df.groupby([df["S. NO."], df["DATE"], df["NAME OF THE DRIVER"], df["FROM"], df["TO"]])
+
+# "individual": one PDF per challan; "consolidated": one multi-page PDF per route and month;
+# "both": the consolidated PDF alongside the individual files
+CHALLAN_OUTPUT_MODES = ["individual", "consolidated", "both"]
+
+def load_shipments_timed(uploaded_file, load_options=None, run_stats=None, show_report=show_load_report):
+    """load_shipments timed as the "load" stage of run_stats (see new_run_stats), with the
+    load report passed to show_report. Returns the shipments frame."""
+    with timed_stage(run_stats, "load") as stage:
+        df, report = load_shipments(uploaded_file, **(load_options or {}))
+        stage["docs"] += len(df)
+    show_report(report)
+    return df
+
+def plan_challan_documents(uploaded_file, route_hamali, load_options=None, incremental=False,
+                           output_mode="individual", bookmarks=True, run_stats=None,
+                           show_report=show_load_report):
+    """Works out every challan, consolidated and route summary PDF without rendering any:
+    load_shipments_timed followed by plan_challans."""
+    df = load_shipments_timed(uploaded_file, load_options, run_stats, show_report)
+    return plan_challans(df, route_hamali, incremental, output_mode, bookmarks, run_stats)
+
+def plan_challans(df, route_hamali, incremental=False, output_mode="individual", bookmarks=True,
+                  run_stats=None):
+    """plan_challan_documents on already loaded shipments, timed as the "group" stage of
+    run_stats. output_mode is one of CHALLAN_OUTPUT_MODES; consolidated PDFs get a bookmark
+    per challan unless bookmarks is False. With incremental, challans unchanged since an
+    earlier run are left out, and so is a consolidated PDF whose challans are all unchanged
+    (route summaries always cover all challans). Individual challans and consolidated PDFs
+    are fingerprinted separately, so switching output_mode renders what the other mode never
+    wrote. Returns (month_wise_data, challan_count,
+    summary_count, unchanged_count, fingerprints), where month_wise_data[month][route]
+    lists (file name, render job) pairs for render_pdfs or render_document. Nothing is
+    recorded here: pass fingerprints to save_fingerprints once the documents have been
+    written, so that later incremental runs skip them."""
+    with timed_stage(run_stats, "group") as stage:
+        planned = _plan_challans(df, route_hamali, incremental, output_mode, bookmarks)
+        stage["docs"] += planned[1]
+    return planned
+
+def _plan_challans(df, route_hamali, incremental, output_mode, bookmarks):
+    """plan_challans without the timing."""
+    challans, line_items, row_order = aggregate_challans(df)
+    row_hashes = pd.util.hash_pandas_object(
+        df[[c for c in FINGERPRINT_COLUMNS if c in df.columns]], index=False).to_numpy()
+    known_fingerprints = load_fingerprints() if incremental else {}
+    fingerprints = {}  # identity -> fingerprint of every document written, saved by the caller
     month_wise_data = {}
-    route_summaries = {}
+    route_books = {}  # (month_key, from, to) -> [(meta, rows)] of its consolidated PDF
+    book_fingerprints = {}  # (month_key, from, to) -> fingerprints of those challans
+    unchanged_challans = {}  # challan identity -> its individual PDF is unchanged
+    challan_keys = []  # (identity, summary_key) of every challan
+    jobs, targets = [], []  # render job and (month_key, route_key, fname) it is filed under
     challan_counter = 0
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-    total_groups = len(groups)
     
-    for idx, ((serial_no, date, driver, FROM, TO), grp) in enumerate(groups):
+    for challan in challans.to_dict("records"):
         challan_counter += 1
-        progress_bar.progress((idx + 1) / total_groups)
-        status_text.text(f"Processing challan {challan_counter}/{total_groups}...")
-        rows = []
-        for _, r in grp.iterrows():
-            rows.append({
-                "CONSIGNOR": r["CONSIGNOR"],
-                "CONSIGNEE": r["CONSIGNEE"],
-                "WT": r["WT"],
-                "PKGS": r["PKGS"],
-                "FREIGHT": r["FREIGHT"],
-                "AMOUNT": r["AMOUNT"]
-            })
-        total_wt = grp["WT"].sum()
-        total_pkgs = grp["PKGS"].sum()
-        total_amount = grp["AMOUNT"].sum()
-        hire = grp["Hire"].iloc[0]
-        
+        serial_no, date, driver, FROM, TO = (challan[k] for k in CHALLAN_KEYS)
+        rows = line_items[challan["start"]:challan["end"]]
+        meta = challan_meta(challan, route_hamali)
         route_key = f"{FROM}_TO_{TO}"
-        hamali_loading = route_hamali.get(route_key, {}).get("loading", 0)
-        hamali_unloading = route_hamali.get(route_key, {}).get("unloading", 0)
-        hamali_total = hamali_loading + hamali_unloading
-        other_exp = 0
-        balance = total_amount - hire - hamali_total - other_exp
-
-        meta = {
-            "FROM": FROM,
-            "TO": TO,
-            "month": date.strftime("%B").upper() if not pd.isna(date) else "",
-            "driver": driver,
-            "driver_mob": grp["DRIVER MOB. NO."].iloc[0] if "DRIVER MOB. NO." in grp.columns else "NA",
-            "truck": grp["TRUCK NO."].iloc[0] if "TRUCK NO." in grp.columns else "NA",
-            "challan_no": str(serial_no),
-            "date": date.strftime("%d/%m/%Y") if not pd.isna(date) else "",
-            "total_wt": total_wt,
-            "total_pkgs": total_pkgs,
-            "total_amount": total_amount,
-            "hire": hire,
-            "hamali_loading": hamali_loading,
-            "hamali_unloading": hamali_unloading,
-            "other_exp": other_exp,
-            "balance": balance,
-        }
-
-        pdf_buffer = io.BytesIO()
-        draw_pdf(pdf_buffer, meta, rows)
-        pdf_buffer.seek(0)
-        safe_serial = str(serial_no).replace("/", "-").replace("\\", "-").replace(" ", "_")
-        fname = f"{date.strftime('%Y%m%d')}__{safe_serial}__{driver.replace(' ','_')}__{FROM}_to_{TO}.pdf"
+
         month_key = date.strftime("%B_%Y") if not pd.isna(date) else "Unknown_Month"
-        if month_key not in month_wise_data: month_wise_data[month_key] = {}
-        if route_key not in month_wise_data[month_key]: month_wise_data[month_key][route_key] = []
-        month_wise_data[month_key][route_key].append((fname, pdf_buffer.getvalue()))
-        
+        identity = challan_identity(serial_no, date, driver, FROM, TO)
+        fingerprint = challan_fingerprint(row_hashes[row_order[challan["start"]:challan["end"]]],
+                                          route_hamali.get(route_key, {}))
         summary_key = (month_key, FROM, TO)
-        if summary_key not in route_summaries: route_summaries[summary_key] = []
-        route_summaries[summary_key].append({
-            "date": date.strftime("%d/%m/%Y") if not pd.isna(date) else "",
-            "truck_no": meta["truck"],
-            "challan_no": str(serial_no),
-            "qty": str(int(total_pkgs)),
-            "weight": str(int(total_wt)),
-            "topay": str(round(total_amount, 1)),
-            "hire": str(int(hire)),
-            "hamali": str(int(hamali_total)),
-            "balance": str(round(balance, 1))
-        })
+        route_books.setdefault(summary_key, []).append((meta, rows))
+        book_fingerprints.setdefault(summary_key, []).append(fingerprint)
+        challan_keys.append((identity, summary_key))
+        if output_mode == "consolidated":
+            continue
+        fingerprints[identity] = fingerprint
+        unchanged_challans[identity] = known_fingerprints.get(identity) == fingerprint
+        if not unchanged_challans[identity]:
+            safe_serial = str(serial_no).replace("/", "-").replace("\\", "-").replace(" ", "_")
+            fname = f"{date.strftime('%Y%m%d')}__{safe_serial}__{driver.replace(' ','_')}__{FROM}_to_{TO}.pdf"
+            jobs.append(("challan", (meta, rows)))
+            targets.append((month_key, route_key, fname))
     
-    status_text.text("Generating summary reports...")
+    unchanged_books = set()
+    if output_mode != "individual":
+        for (month_key, route_from, route_to), pages in route_books.items():
+            identity = f"book|{month_key}|{route_from}|{route_to}"
+            fingerprint = book_fingerprint(book_fingerprints[(month_key, route_from, route_to)], bookmarks)
+            fingerprints[identity] = fingerprint
+            if known_fingerprints.get(identity) == fingerprint:
+                unchanged_books.add((month_key, route_from, route_to))
+                continue
+            jobs.append(("challan_book", (pages, bookmarks)))
+            targets.append((month_key, f"{route_from}_TO_{route_to}",
+                            f"CHALLANS__{route_from}_TO_{route_to}__{month_key}.pdf"))
+
+    # a challan counts as unchanged when every document it appears in was skipped
+    unchanged_count = sum(unchanged_challans.get(identity, True) and
+                          (output_mode == "individual" or summary_key in unchanged_books)
+                          for identity, summary_key in challan_keys)
+    route_summaries = summarize_routes(challans, route_hamali)
     for (month_key, route_from, route_to), summary_rows in route_summaries.items():
-        summary_rows.sort(key=lambda x: x["date"])
-        pdf_buffer = io.BytesIO()
         month_display = month_key.replace("_", " ")
-        draw_summary_pdf(pdf_buffer, route_from, route_to, month_display.upper(), summary_rows)
-        pdf_buffer.seek(0)
-        route_key = f"{route_from}_TO_{route_to}"
-        fname = f"SUMMARY__{route_from}_TO_{route_to}__{month_key}.pdf"
+        jobs.append(("summary", (route_from, route_to, month_display.upper(), summary_rows)))
+        targets.append((month_key, f"{route_from}_TO_{route_to}",
+                        f"SUMMARY__{route_from}_TO_{route_to}__{month_key}.pdf"))
+
+    for (month_key, route_key, fname), job in zip(targets, jobs):
         if month_key not in month_wise_data: month_wise_data[month_key] = {}
         if route_key not in month_wise_data[month_key]: month_wise_data[month_key][route_key] = []
-        month_wise_data[month_key][route_key].append((fname, pdf_buffer.getvalue()))
+        month_wise_data[month_key][route_key].append((fname, job))
     
-    progress_bar.progress(1.0)
-    status_text.text("✅ Processing complete!")
-    return month_wise_data, challan_counter, len(route_summaries)
+    return month_wise_data, challan_counter, len(route_summaries), unchanged_count, fingerprints
+
+def process_excel_file(uploaded_file, route_hamali, archive, load_options=None, incremental=False,
+                       workers=RENDER_WORKERS, output_mode="individual", bookmarks=True, cache_stats=None,
+                       run_stats=None, show_progress=None, show_report=show_load_report):
+    """Renders the documents plan_challan_documents lays out into `archive`, a ZipFile open
+    for writing, as "<month>/<route>/<file>.pdf" members (see write_documents). PDFs are
+    rendered in up to `workers` processes, or read from the PDF cache when cache_stats is
+    given (see render_pdfs); every stage is timed into run_stats. Progress goes to
+    show_progress(fraction, text), by default a progress bar in the page. The challans'
+    fingerprints are saved once everything is written. Returns (month_wise_data,
+    challan_count, summary_count, unchanged_count) as plan_challan_documents does, but
+    month_wise_data lists (file name, archive member) pairs."""
+    show = show_progress or streamlit_progress()
+    show(0, "Preparing challans...")
+    month_wise_data, challan_count, summary_count, unchanged_count, fingerprints = plan_challan_documents(
+        uploaded_file, route_hamali, load_options, incremental, output_mode, bookmarks, run_stats, show_report)
+    entries = challan_entries(month_wise_data)
+    write_documents(archive, entries, workers, cache_stats, run_stats,
+                    progress_reporter(show, len(entries), "Rendering PDF", run_stats))
+    save_fingerprints(fingerprints)
+    for month_key, routes in month_wise_data.items():
+        for route_key, files in routes.items():
+            routes[route_key] = [(fname, f"{month_key}/{route_key}/{fname}") for fname, _ in files]
+    
+    show(1.0, "✅ Processing complete!")
+    return month_wise_data, challan_count, summary_count, unchanged_count
 
 # --- Ledger Processing Function ---
-def generate_weekly_ledgers(uploaded_file, consignor_old_balances):
-    xls = pd.ExcelFile(uploaded_file)
-    df = pd.concat([pd.read_excel(uploaded_file, s, dtype=str) for s in xls.sheet_names], ignore_index=True)
-    
-    df.columns = [c.strip() for c in df.columns]
-    df["DATE"] = df["DATE"].apply(parse_date_flexible)
-    df["FROM"] = df["FROM"].apply(clean_city)
-    df["TO"] = df["TO"].apply(clean_city)
-    df["CONSIGNOR"] = df["CONSIGNOR"].apply(clean_consignor)
-    df["CONSIGNEE"] = df["CONSIGNEE"].apply(clean_consignor)
-    df["WT"] = df["WT. Kgs."].apply(clean_num)
-    df["PKGS"] = df["NO. OF Pkgs"].apply(clean_num)
-    df["AMOUNT"] = df["AMOUNT"].apply(clean_num)
-    df["Hire"] = df["Hire"].apply(clean_num)
-    
-    # Filter valid dates and routes
-    df = df[df["DATE"].notna() & (df["FROM"] != "") & (df["TO"] != "")].copy()
-    
-    # Add week information (Monday to Sunday)
-    df["WEEK_START"] = df["DATE"].apply(lambda x: get_week_info(x)[0])
-    df["WEEK_END"] = df["DATE"].apply(lambda x: get_week_info(x)[1])
-    df["WEEK_RANGE"] = df["DATE"].apply(lambda x: get_week_info(x)[2])
-    df["ROUTE"] = df["FROM"] + " → " + df["TO"]
+def generate_weekly_ledgers(uploaded_file, consignor_old_balances, load_options=None, cache_stats=None,
+                            lazy=False, workers=RENDER_WORKERS, run_stats=None, show_progress=None,
+                            show_report=show_load_report):
+    """Bill, ledger and Excel file per consignor, week and route, rendered in up to
+    `workers` processes. With cache_stats (see new_cache_stats), bill and ledger PDFs go
+    through the on-disk PDF cache. With lazy, nothing is rendered: each file holds its
+    render job (for render_document) instead of its bytes. The load, clean, group and
+    render stages are timed into run_stats (see new_run_stats). Progress goes to
+    show_progress(fraction, text), by default a progress bar in the page, and the load
+    report to show_report."""
+    show = show_progress or streamlit_progress()
+    df = load_shipments_timed(uploaded_file, load_options, run_stats, show_report)
+    with timed_stage(run_stats, "clean") as stage:
+        df["CONSIGNEE"] = clean_consignor_column(df["CONSIGNEE"])
+        
+        # Filter valid dates and routes
+        df = df[df["DATE"].notna() & (df["FROM"] != "") & (df["TO"] != "")].copy()
+        
+        # Week (Monday to Sunday) of every row by period arithmetic, labelled once per week.
+        # Unlike get_week_info on a raw date, WEEK_START is Monday at midnight: rows of one
+        # week with different times of day share one ledger instead of splitting into
+        # groups that overwrite each other under the same week key and file names.
+        df["WEEK_START"] = df["DATE"].dt.to_period("W-SUN").dt.start_time
+        weeks = {week_start: get_week_info(week_start) for week_start in df["WEEK_START"].unique()}
+        df["ROUTE"] = df["FROM"].astype(str) + " → " + df["TO"].astype(str)
+        stage["docs"] += len(df)
     
     # Group by consignor, week, route
     ledger_data = {}
     
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-    
-    groups = df.groupby(["CONSIGNOR", "WEEK_START", "WEEK_END", "WEEK_RANGE", "ROUTE", "FROM", "TO"])
-    total_groups = len(groups)
-    
-    for idx, ((consignor, week_start, week_end, week_range, route, from_city, to_city), grp) in enumerate(groups):
-        progress_bar.progress((idx + 1) / total_groups)
-        status_text.text(f"Generating ledger {idx + 1}/{total_groups}...")
+    with timed_stage(run_stats, "group") as stage:
+        grouped = df.groupby(["CONSIGNOR", "WEEK_START", "ROUTE", "FROM", "TO"], observed=True)
+        total_groups = grouped.ngroups
+        row_order, starts, ends = group_slices(grouped, total_groups)
+        group_keys = df[["CONSIGNOR", "WEEK_START", "ROUTE"]].iloc[row_order[starts]].itertuples(index=False, name=None)
+        # Every group's shipment details in one go, sliced per group below
+        shipment_rows = pd.DataFrame({
+            "date": df["DATE"].dt.strftime("%d/%m/%Y"),
+            "consignee": df["CONSIGNEE"],
+            "wt": df["WT"],
+            "pkgs": df["PKGS"],
+            "amount": df["AMOUNT"]
+        }).iloc[row_order].to_dict("records")
+        totals = {col: slice_sums(df[col].to_numpy()[row_order], starts, ends)
+                  for col in ("WT", "PKGS", "AMOUNT", "Hire")}
+        report_progress = progress_reporter(show, total_groups, "Preparing ledger", run_stats)
         
-        # Use the manual old balance for this specific consignor
-        previous_balance = consignor_old_balances.get(consignor, 0)
+        for idx, ((consignor, week_start, route), start, end) in enumerate(zip(group_keys, starts, ends)):
+            report_progress(idx + 1)
+            week_start, week_end, week_range = weeks[week_start]
         
-        # Prepare shipment details
-        shipments = []
-        for _, row in grp.iterrows():
-            shipments.append({
-                "date": row["DATE"].strftime("%d/%m/%Y"),
-                "consignee": row["CONSIGNEE"],
-                "wt": row["WT"],
-                "pkgs": row["PKGS"],
-                "amount": row["AMOUNT"]
-            })
-        
-        # Calculate summary
-        total_trips = len(grp)
-        total_wt = grp["WT"].sum()
-        total_pkgs = grp["PKGS"].sum()
-        total_amount = grp["AMOUNT"].sum()
-        total_hire = grp["Hire"].sum()
-        net_amount = total_amount - total_hire
-        final_balance = net_amount + previous_balance
+            # Use the manual old balance for this specific consignor
+            previous_balance = consignor_old_balances.get(consignor, 0)
+            shipments = shipment_rows[start:end]
         
-        summary = {
-            "total_trips": total_trips,
-            "total_wt": total_wt,
-            "total_pkgs": total_pkgs,
-            "total_amount": total_amount,
-            "total_hire": total_hire,
-            "net_amount": net_amount,
-            "previous_balance": previous_balance,
-            "final_balance": final_balance
-        }
+            # Calculate summary
+            total_trips = int(end - start)
+            total_wt = totals["WT"][idx]
+            total_pkgs = totals["PKGS"][idx]
+            total_amount = totals["AMOUNT"][idx]
+            total_hire = totals["Hire"][idx]
+            net_amount = total_amount - total_hire
+            final_balance = net_amount + previous_balance
         
-        # Generate BILL PDF
-        bill_buffer = io.BytesIO()
-        draw_bill_pdf(bill_buffer, consignor, route, week_range, shipments, summary)
-        bill_buffer.seek(0)
-
-        # Generate LEDGER PDF (no old balance)
-        ledger_buffer = io.BytesIO()
-        draw_ledger_pdf(ledger_buffer, consignor, route, week_range, shipments, summary)
-        ledger_buffer.seek(0)
+            summary = {
+                "total_trips": total_trips,
+                "total_wt": total_wt,
+                "total_pkgs": total_pkgs,
+                "total_amount": total_amount,
+                "total_hire": total_hire,
+                "net_amount": net_amount,
+                "previous_balance": previous_balance,
+                "final_balance": final_balance
+            }
         
-        # Generate Excel
-        excel_buffer = io.BytesIO()
-        with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
-            # Shipments sheet
-            shipments_df = pd.DataFrame(shipments)
-            shipments_df.to_excel(writer, sheet_name='Shipments', index=False)
-            
-            # Summary sheet
-            summary_df = pd.DataFrame([{
-                "Week Range": week_range,
-                "Consignor": consignor,
-                "Route": route,
-                "Total Trips": total_trips,
-                "Total Weight (KG)": total_wt,
-                "Total Packages": total_pkgs,
-                "Total Amount (₹)": total_amount,
-                "Total Hire (₹)": total_hire,
-                "Net Amount (₹)": net_amount,
-                "Previous Outstanding (₹)": previous_balance,
-                "Final Balance (₹)": final_balance
-            }])
-            summary_df.to_excel(writer, sheet_name='Summary', index=False)
-        excel_buffer.seek(0)
+            # BILL and LEDGER PDFs (the ledger shows no old balance) and the Excel file
+            doc_args = (consignor, route, week_range, shipments, summary)
+            documents = {"bill_pdf": ("bill", doc_args), "ledger_pdf": ("ledger", doc_args),
+                         "excel": ("ledger_excel", doc_args)}
+            # Organize by consignor > week (using week_start as key for chronological sorting)
+            if consignor not in ledger_data:
+                ledger_data[consignor] = {}
         
-        # Organize by consignor > week (using week_start as key for chronological sorting)
-        if consignor not in ledger_data:
-            ledger_data[consignor] = {}
+            week_key = week_start.strftime('%Y-%m-%d')  # Use date as key for proper sorting
+            if week_key not in ledger_data[consignor]:
+                ledger_data[consignor][week_key] = {}
         
-        week_key = week_start.strftime('%Y-%m-%d')  # Use date as key for proper sorting
-        if week_key not in ledger_data[consignor]:
-            ledger_data[consignor][week_key] = {}
-        
-        route_safe = route.replace(' → ', '_to_')
-        ledger_data[consignor][week_key][route_safe] = {
-            "bill_pdf": (
-                f"{consignor}__{week_range.replace(' - ', '_to_').replace(' ', '_')}__{route_safe}__BILL.pdf",
-                bill_buffer.getvalue()
-            ),
-            "ledger_pdf": (
-                f"{consignor}__{week_range.replace(' - ', '_to_').replace(' ', '_')}__{route_safe}__LEDGER.pdf",
-                ledger_buffer.getvalue()
-            ),
-            "excel": (
-                f"{consignor}__{week_range.replace(' - ', '_to_').replace(' ', '_')}__{route_safe}.xlsx",
-                excel_buffer.getvalue()
-            ),
-            "summary": summary,
-            "week_start": week_start,
-            "week_end": week_end,
-            "route": route,
-            "week_range": week_range
-        }
+            route_safe = route.replace(' → ', '_to_')
+            ledger_data[consignor][week_key][route_safe] = {
+                "bill_pdf": (
+                    f"{consignor}__{week_range.replace(' - ', '_to_').replace(' ', '_')}__{route_safe}__BILL.pdf",
+                    documents["bill_pdf"]
+                ),
+                "ledger_pdf": (
+                    f"{consignor}__{week_range.replace(' - ', '_to_').replace(' ', '_')}__{route_safe}__LEDGER.pdf",
+                    documents["ledger_pdf"]
+                ),
+                "excel": (
+                    f"{consignor}__{week_range.replace(' - ', '_to_').replace(' ', '_')}__{route_safe}.xlsx",
+                    documents["excel"]
+                ),
+                "summary": summary,
+                "week_start": week_start,
+                "week_end": week_end,
+                "route": route,
+                "week_range": week_range
+            }
+        stage["docs"] += total_groups
     
-    progress_bar.progress(1.0)
-    status_text.text("✅ Ledger generation complete!")
+    if not lazy:
+        files = [(entry, name) for weeks in ledger_data.values() for routes in weeks.values()
+                 for entry in routes.values() for name in ("bill_pdf", "ledger_pdf", "excel")]
+        rendered = timed_iter(run_stats, "render", render_pdfs(
+            [entry[name][1] for entry, name in files], workers,
+            progress_reporter(show, len(files), "Rendering file", run_stats), cache_stats))
+        for content, (entry, name) in zip(rendered, files):
+            entry[name] = (entry[name][0], content)
+    show(1.0, "✅ Ledger generation complete!")
     
     return ledger_data
 
+# --- Session Results (kept across Streamlit reruns) ---
+
+RESULTS_STATE_KEY = "generation_results"
+RESULTS_SESSION_BYTES = 256 * 1024 * 1024  # per browser session; least recently used results go first
+
+def results_key(kind, uploaded_file, settings):
+    """Identifies a generation by its upload's content and every setting that shapes the output."""
+    h = hashlib.sha256(kind.encode())
+    h.update(hashlib.sha256(read_upload(uploaded_file)).digest())
+    h.update(json.dumps(settings, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+def _results():
+    """key -> result of this session, least recently used first."""
+    if RESULTS_STATE_KEY not in st.session_state: st.session_state[RESULTS_STATE_KEY] = {}
+    return st.session_state[RESULTS_STATE_KEY]
+
+def store_result(key, data, cache_stats=None, run_stats=None):
+    """Keeps `data` for this session under key, replacing an earlier result for it."""
+    results = _results()
+    results.pop(key, None)
+    results[key] = {"data": data, "cache_stats": cache_stats, "run_stats": run_stats, "archives": {},
+                    "data_bytes": len(pickle.dumps(data, pickle.HIGHEST_PROTOCOL))}
+    trim_results()
+
+def get_result(key):
+    results = _results()
+    if key not in results: return None
+    results[key] = results.pop(key)  # now the most recently used
+    return results[key]
+
+def result_archive(result, name, make):
+    """The deferred archive `name` of a stored result, made with make() on first use so
+    that a ZIP is rendered once per result rather than once per rerun."""
+    if name not in result["archives"]: result["archives"][name] = make()
+    return result["archives"][name]
+
+def result_bytes(result):
+    """Approximate memory held by a result: its data plus every archive built so far."""
+    return result["data_bytes"] + sum(
+        spooled_size(archive.spool) for archive in result["archives"].values() if archive.spool is not None)
+
+def trim_results(max_bytes=None):
+    """Drops least recently used results until the session's results fit in max_bytes
+    (default RESULTS_SESSION_BYTES); the most recent one is always kept."""
+    if max_bytes is None: max_bytes = RESULTS_SESSION_BYTES
+    results = _results()
+    total = sum(result_bytes(result) for result in results.values())
+    while len(results) > 1 and total > max_bytes:
+        total -= result_bytes(results.pop(next(iter(results))))
+
+def discard_result(key):
+    _results().pop(key, None)
+
+def clear_results():
+    _results().clear()
+
+def results_usage():
+    """(result count, approximate bytes) held by this session."""
+    results = _results()
+    return len(results), sum(result_bytes(result) for result in results.values())
+
 # --- Main App ---
 def main():
     st.set_page_config(
@@ -726,6 +2234,7 @@ def main():
         layout="wide",
         initial_sidebar_state="expanded"
     )
+    st.markdown(APP_CSS, unsafe_allow_html=True)
     st.markdown("""
     <div class="main-header">
         <h1>🚚 Transport Challan & Ledger Generator Pro</h1>
@@ -738,6 +2247,7 @@ def main():
         st.title("📋 Features")
         st.markdown("""
         ✅ **Multi-sheet Excel support**  
+        ✅ **CSV / TSV input**  
         ✅ **Auto route detection**  
         ✅ **Professional PDF design**  
         ✅ **Summary reports**  
@@ -748,7 +2258,55 @@ def main():
         """)
         st.divider()
         st.markdown("### 💡 Quick Tips")
-        st.info("Upload Excel with columns: S. NO., DATE, FROM, TO, CONSIGNOR, CONSIGNEE, etc.")
+        st.info("Upload Excel (or CSV/TSV) with columns: S. NO., DATE, FROM, TO, CONSIGNOR, CONSIGNEE, etc.")
+        st.divider()
+        st.markdown("### ⚙️ Performance")
+        low_memory = st.checkbox(
+            "Low-memory streaming read",
+            help="Read very large .xlsx workbooks in cleaned chunks instead of all at once")
+        stream_rows = st.number_input(
+            "Rows per chunk", min_value=1000, value=STREAM_CHUNK_ROWS, step=5000, disabled=not low_memory)
+        chunk_size = int(stream_rows) if low_memory else None
+        workers = int(st.number_input(
+            "Sheet parsing workers", min_value=1, max_value=os.cpu_count() or 1, value=SHEET_WORKERS,
+            help="Parse multi-sheet workbooks in parallel processes"))
+        render_workers = int(st.number_input(
+            "PDF rendering workers", min_value=1, max_value=os.cpu_count() or 1, value=RENDER_WORKERS,
+            help="Render challan and summary PDFs in parallel processes"))
+        use_snapshots = st.checkbox(
+            "Reuse stored snapshots", value=True,
+            help="Load a previously processed file from its Parquet snapshot instead of re-reading the spreadsheet")
+        store_only = st.checkbox(
+            "Store files in ZIPs without compression",
+            help="Faster downloads to build; PDFs and Excel files are already compressed")
+        use_pdf_cache = st.checkbox(
+            "Reuse cached PDFs", value=True,
+            help="Read documents whose contents are unchanged since an earlier run from the on-disk PDF cache")
+        load_options = {"chunk_size": chunk_size, "workers": workers, "snapshots": use_snapshots}
+        with st.expander("🗄️ Stored Snapshots"):
+            snapshots = list_snapshots()
+            if snapshots:
+                st.dataframe(pd.DataFrame(snapshots).drop(columns=["content_hash"]), hide_index=True)
+            else:
+                st.caption("No snapshots stored yet")
+            prune_days = st.number_input("Remove snapshots unused for (days)", min_value=0, value=30)
+            if st.button("🧹 Prune Snapshots", disabled=not snapshots):
+                removed = prune_snapshots(max_age_days=prune_days)
+                st.success(f"Removed {removed} snapshot(s)")
+        with st.expander("🗃️ PDF Cache"):
+            cached_files, cached_bytes = pdf_cache_usage()
+            st.caption(f"{cached_files} PDF(s), {cached_bytes / 1024 / 1024:.1f} of "
+                       f"{PDF_CACHE_BYTES / 1024 / 1024:.0f} MB")
+            if st.button("🧹 Clear PDF Cache", disabled=not cached_files):
+                st.success(f"Removed {evict_pdf_cache(0)} PDF(s)")
+        with st.expander("🧠 Generated Results"):
+            trim_results()
+            result_count, result_size = results_usage()
+            st.caption(f"{result_count} result(s) kept for this session, {result_size / 1024 / 1024:.1f} of "
+                       f"{RESULTS_SESSION_BYTES / 1024 / 1024:.0f} MB")
+            if st.button("🧹 Clear Generated Results", disabled=not result_count):
+                clear_results()
+                st.rerun()
         st.divider()
         st.markdown("### 📞 Support")
         st.markdown("Need help? Contact us!")
@@ -769,21 +2327,35 @@ def main():
             st.markdown("### 📤 Upload Your Excel File")
             uploaded_file = st.file_uploader(
                 "Choose your transport data file",
-                type=['xlsx', 'xls'],
-                help="Upload Excel with transport data",
+                type=UPLOAD_TYPES,
+                help="Upload Excel, CSV or TSV with transport data",
                 key="challan_upload"
             )
         with col2:
             st.markdown("### ⚙️ Settings")
             other_exp = st.number_input("Other Expenses", value=0, step=100)
+            incremental = st.checkbox(
+                "Only new/changed challans",
+                help="Skip challans whose rows and hamali are unchanged since they were last "
+                     "downloaded in a Download All ZIP; route summaries are still rebuilt in full")
+            output_mode = st.radio(
+                "Challan PDFs", CHALLAN_OUTPUT_MODES,
+                format_func={"individual": "One file per challan",
+                             "consolidated": "One file per route & month",
+                             "both": "Both"}.get,
+                help="A route-month file holds all its challans as consecutive pages: "
+                     "far smaller and faster to build than thousands of single-page files")
+            bookmarks = st.checkbox(
+                "Bookmark each challan", value=True, disabled=output_mode == "individual",
+                help="Add a PDF bookmark per challan number to route-month files")
+            if st.button("🗑️ Forget Challan History"):
+                forget_fingerprints()
+                st.success("Challan history cleared")
         
         route_hamali = None
         if uploaded_file:
-            xls = pd.ExcelFile(uploaded_file)
-            df = pd.concat([pd.read_excel(uploaded_file, s, dtype=str) for s in xls.sheet_names], ignore_index=True)
-            df["FROM"] = df["FROM"].apply(clean_city)
-            df["TO"] = df["TO"].apply(clean_city)
-            routes = sorted({(row["FROM"], row["TO"]) for _, row in df.iterrows() if row["FROM"] and row["TO"]})
+            df, _ = load_shipments(uploaded_file, **load_options)
+            routes = list_routes(df)
 
             st.markdown("### 🛣️ Set Hamali For Each Route (Loading/Unloading)")
             route_hamali = {}
@@ -795,138 +2367,159 @@ def main():
                 with colB:
                     hamali_loading = st.number_input(
                         f"Loading Hamali ({route_from} → {route_to})", min_value=0, max_value=50000,
-                        value=1700, key=f"hamali_load_{route_key}")
+                        value=DEFAULT_HAMALI["loading"], key=f"hamali_load_{route_key}")
                 with colC:
                     hamali_unloading = st.number_input(
                         f"Unloading Hamali ({route_from} → {route_to})", min_value=0, max_value=50000,
-                        value=1700, key=f"hamali_unload_{route_key}")
+                        value=DEFAULT_HAMALI["unloading"], key=f"hamali_unload_{route_key}")
                 route_hamali[route_key] = {"loading": hamali_loading, "unloading": hamali_unloading}
         
-        if uploaded_file and route_hamali and st.button(
-            "🎯 Generate Challans & Reports", type="primary", use_container_width=True):
-            with st.spinner("Processing your file..."):
-                try:
-                    month_wise_data, challan_count, summary_count = process_excel_file(uploaded_file, route_hamali)
+        if uploaded_file and route_hamali:
+            challan_key = results_key("challans", uploaded_file, {
+                "route_hamali": route_hamali, "incremental": incremental, "output_mode": output_mode,
+                "bookmarks": bookmarks, "store_only": store_only})
+            if st.button("🎯 Generate Challans & Reports", type="primary", use_container_width=True):
+                with st.spinner("Processing your file..."):
+                    try:
+                        # Only the document list is worked out here; each download renders its files when clicked
+                        cache_stats = new_cache_stats() if use_pdf_cache else None
+                        run_stats = new_run_stats("challans")
+                        store_result(challan_key, plan_challan_documents(
+                            uploaded_file, route_hamali, load_options, incremental, output_mode, bookmarks,
+                            run_stats), cache_stats, run_stats)
+                    except Exception as e:
+                        st.error(f"❌ Error: {str(e)}")
+                        st.exception(e)
+            challan_result = get_result(challan_key)
+        else:
+            challan_result = None
+
+        if challan_result:
+            try:
+                month_wise_data, challan_count, summary_count, unchanged_count, fingerprints = challan_result["data"]
+                cache_stats, run_stats = challan_result["cache_stats"], challan_result["run_stats"]
+                challan_count -= unchanged_count
+                if st.button("♻️ Discard These Results", key="discard_challans",
+                             help="Forget these challans; the next Generate works them out again"):
+                    discard_result(challan_key)
+                    st.rerun()
+                st.markdown(f"""
+                <div class="success-message">
+                    <h3>✅ Success! Generated {challan_count} Challans & {summary_count} Summary Reports</h3>
+                    <p>Organized by {len(month_wise_data)} month(s)</p>
+                </div>
+                """, unsafe_allow_html=True)
+                if unchanged_count:
+                    st.info(f"♻️ {unchanged_count} unchanged challan(s) from earlier runs were skipped")
+                if cache_stats:
+                    show_cache_stats(cache_stats)
+                show_run_stats(run_stats, deferred=True)
+                
+                col1, col2, col3 = st.columns(3)
+                with col1:
                     st.markdown(f"""
-                    <div class="success-message">
-                        <h3>✅ Success! Generated {challan_count} Challans & {summary_count} Summary Reports</h3>
-                        <p>Organized by {len(month_wise_data)} month(s)</p>
+                    <div class="stats-box">
+                        <h2>{challan_count}</h2>
+                        <p>Challans Generated</p>
+                    </div>
+                    """, unsafe_allow_html=True)
+                with col2:
+                    st.markdown(f"""
+                    <div class="stats-box">
+                        <h2>{len(month_wise_data)}</h2>
+                        <p>Months Processed</p>
+                    </div>
+                    """, unsafe_allow_html=True)
+                with col3:
+                    total_routes = sum(len(routes) for routes in month_wise_data.values())
+                    st.markdown(f"""
+                    <div class="stats-box">
+                        <h2>{total_routes}</h2>
+                        <p>Route-Month Combinations</p>
                     </div>
                     """, unsafe_allow_html=True)
                     
-                    col1, col2, col3 = st.columns(3)
-                    with col1:
-                        st.markdown(f"""
-                        <div class="stats-box">
-                            <h2>{challan_count}</h2>
-                            <p>Challans Generated</p>
-                        </div>
-                        """, unsafe_allow_html=True)
-                    with col2:
-                        st.markdown(f"""
-                        <div class="stats-box">
-                            <h2>{len(month_wise_data)}</h2>
-                            <p>Months Processed</p>
-                        </div>
-                        """, unsafe_allow_html=True)
-                    with col3:
-                        total_routes = sum(len(routes) for routes in month_wise_data.values())
-                        st.markdown(f"""
-                        <div class="stats-box">
-                            <h2>{total_routes}</h2>
-                            <p>Route-Month Combinations</p>
-                        </div>
-                        """, unsafe_allow_html=True)
+                st.markdown("---")
+                st.markdown("### 📥 Download Your Files")
+                # Challans count as done for "Only new/changed challans" once this ZIP is built
+                all_files = result_archive(challan_result, "all", lambda: deferred_archive(
+                    challan_entries(month_wise_data), store_only, render_workers, cache_stats,
+                    run_stats=run_stats, on_built=lambda: save_fingerprints(fingerprints)))
+                col1, col2 = st.columns(2)
+                with col1:
+                    st.download_button(
+                        label="📦 Download All (ZIP) - Month-wise Organized",
+                        data=all_files,
+                        file_name=f"Transport_Challans_MonthWise_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
+                        mime="application/zip",
+                        use_container_width=True
+                    )
                     
-                    st.markdown("---")
-                    st.markdown("### 📥 Download Your Files")
-                    zip_buffer = io.BytesIO()
-                    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                        for month_key, routes in month_wise_data.items():
-                            for route_key, files in routes.items():
-                                for fname, pdf_data in files:
-                                    zip_file.writestr(f"{month_key}/{route_key}/{fname}", pdf_data)
-                    zip_buffer.seek(0)
+                st.markdown("---")
+                st.markdown("### 📅 Month-wise Organization")
+                sorted_months = sorted(month_wise_data.keys(), 
+                                     key=lambda x: datetime.strptime(x, "%B_%Y") if x != "Unknown_Month" else datetime.min)
                     
-                    col1, col2 = st.columns(2)
-                    with col1:
+                for month_key in sorted_months:
+                    routes = month_wise_data[month_key]
+                    month_display = month_key.replace("_", " ")
+                    with st.expander(f"📅 **{month_display}** - {len(routes)} Routes", expanded=True):
+                        month_total_files = sum(len(files) for files in routes.values())
+                        st.info(f"📊 **Total Files:** {month_total_files} (Challans + Summary Reports)")
+                            
+                        month_entries = [(f"{route_key}/{fname}", job)
+                                         for route_key, files in routes.items() for fname, job in files]
+                            
                         st.download_button(
-                            label="📦 Download All (ZIP) - Month-wise Organized",
-                            data=zip_buffer,
-                            file_name=f"Transport_Challans_MonthWise_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
+                            label=f"📥 Download {month_display} (All Routes)",
+                            data=result_archive(challan_result, month_key, lambda: deferred_archive(
+                                month_entries, store_only, render_workers, cache_stats, all_files, f"{month_key}/")),
+                            file_name=f"{month_key}_All_Routes.zip",
                             mime="application/zip",
-                            use_container_width=True
+                            key=f"month_{month_key}"
                         )
-                    
-                    st.markdown("---")
-                    st.markdown("### 📅 Month-wise Organization")
-                    sorted_months = sorted(month_wise_data.keys(), 
-                                         key=lambda x: datetime.strptime(x, "%B_%Y") if x != "Unknown_Month" else datetime.min)
-                    
-                    for month_key in sorted_months:
-                        routes = month_wise_data[month_key]
-                        month_display = month_key.replace("_", " ")
-                        with st.expander(f"📅 **{month_display}** - {len(routes)} Routes", expanded=True):
-                            month_total_files = sum(len(files) for files in routes.values())
-                            st.info(f"📊 **Total Files:** {month_total_files} (Challans + Summary Reports)")
                             
-                            month_zip = io.BytesIO()
-                            with zipfile.ZipFile(month_zip, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                                for route_key, files in routes.items():
-                                    for fname, pdf_data in files:
-                                        zip_file.writestr(f"{route_key}/{fname}", pdf_data)
-                            month_zip.seek(0)
-                            
-                            st.download_button(
-                                label=f"📥 Download {month_display} (All Routes)",
-                                data=month_zip,
-                                file_name=f"{month_key}_All_Routes.zip",
-                                mime="application/zip",
-                                key=f"month_{month_key}"
-                            )
-                            
-                            st.markdown("---")
-                            for route_key, files in routes.items():
-                                route_display = route_key.replace("_TO_", " → ")
-                                col1, col2 = st.columns([3, 1])
-                                with col1:
-                                    st.markdown(f"#### 🛣️ {route_display}")
-                                    st.caption(f"{len(files)} files (Challans + Summary)")
-                                with col2:
-                                    route_zip = io.BytesIO()
-                                    with zipfile.ZipFile(route_zip, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                                        for fname, pdf_data in files:
-                                            zip_file.writestr(fname, pdf_data)
-                                    route_zip.seek(0)
-                                    st.download_button(
-                                        label="📥 Download",
-                                        data=route_zip,
-                                        file_name=f"{month_key}_{route_key}.zip",
-                                        mime="application/zip",
-                                        key=f"{month_key}_{route_key}",
-                                        use_container_width=True
-                                    )
+                        st.markdown("---")
+                        for route_key, files in routes.items():
+                            route_display = route_key.replace("_TO_", " → ")
+                            col1, col2 = st.columns([3, 1])
+                            with col1:
+                                st.markdown(f"#### 🛣️ {route_display}")
+                                st.caption(f"{len(files)} files (Challans + Summary)")
+                            with col2:
+                                st.download_button(
+                                    label="📥 Download",
+                                    data=result_archive(challan_result, f"{month_key}/{route_key}", lambda: deferred_archive(
+                                        files, store_only, render_workers, cache_stats,
+                                        all_files, f"{month_key}/{route_key}/")),
+                                    file_name=f"{month_key}_{route_key}.zip",
+                                    mime="application/zip",
+                                    key=f"{month_key}_{route_key}",
+                                    use_container_width=True
+                                )
                                 
-                                with st.container():
-                                    for i, (fname, pdf_data) in enumerate(files[:5]):
-                                        file_icon = "📊" if "SUMMARY" in fname else "📄"
-                                        col1, col2 = st.columns([4, 1])
-                                        with col1:
-                                            st.text(f"{file_icon} {fname}")
-                                        with col2:
-                                            st.download_button(
-                                                "⬇️",
-                                                data=pdf_data,
-                                                file_name=fname,
-                                                mime="application/pdf",
-                                                key=f"{month_key}_{route_key}_{i}"
-                                            )
-                                    if len(files) > 5:
-                                        st.caption(f"+ {len(files) - 5} more files...")
-                                st.markdown("---")
-                except Exception as e:
-                    st.error(f"❌ Error: {str(e)}")
-                    st.exception(e)
+                            with st.container():
+                                for i, (fname, job) in enumerate(files[:5]):
+                                    file_icon = ("📊" if fname.startswith("SUMMARY") else
+                                                 "📚" if fname.startswith("CHALLANS") else "📄")
+                                    col1, col2 = st.columns([4, 1])
+                                    with col1:
+                                        st.text(f"{file_icon} {fname}")
+                                    with col2:
+                                        st.download_button(
+                                            "⬇️",
+                                            data=deferred_document(job, cache_stats, all_files,
+                                                                   f"{month_key}/{route_key}/{fname}"),
+                                            file_name=fname,
+                                            mime="application/pdf",
+                                            key=f"{month_key}_{route_key}_{i}"
+                                        )
+                                if len(files) > 5:
+                                    st.caption(f"+ {len(files) - 5} more files...")
+                            st.markdown("---")
+            except Exception as e:
+                st.error(f"❌ Error: {str(e)}")
+                st.exception(e)
     
     # ---------------- TAB 2: WEEKLY LEDGERS ----------------
     with tab2:
@@ -935,8 +2528,8 @@ def main():
         
         uploaded_ledger_file = st.file_uploader(
             "Choose your transport data file for ledger generation",
-            type=['xlsx', 'xls'],
-            help="Upload Excel with transport data",
+            type=UPLOAD_TYPES,
+            help="Upload Excel, CSV or TSV with transport data",
             key="ledger_upload"
         )
         
@@ -944,10 +2537,7 @@ def main():
         
         if uploaded_ledger_file:
             # Read file to get list of consignors
-            xls = pd.ExcelFile(uploaded_ledger_file)
-            df_preview = pd.concat([pd.read_excel(uploaded_ledger_file, s, dtype=str) for s in xls.sheet_names], ignore_index=True)
-            df_preview.columns = [c.strip() for c in df_preview.columns]
-            df_preview["CONSIGNOR"] = df_preview["CONSIGNOR"].apply(clean_consignor)
+            df_preview, _ = load_shipments(uploaded_ledger_file, **load_options)
             
             # Get unique consignors
             consignors = sorted([c for c in df_preview["CONSIGNOR"].unique() if c and c != ""])
@@ -974,153 +2564,188 @@ def main():
             
             st.markdown("---")
         
-        if uploaded_ledger_file and st.button(
-            "📊 Generate Weekly Ledgers", type="primary", use_container_width=True):
-            with st.spinner("Generating weekly ledgers..."):
-                try:
-                    ledger_data = generate_weekly_ledgers(uploaded_ledger_file, consignor_old_balances)
+            excel_mode = st.radio(
+                "Excel files", LEDGER_EXCEL_MODES, horizontal=True,
+                format_func={"per_ledger": "One per week & route",
+                             "consignor": "One workbook per consignor",
+                             "run": "One workbook for everything"}.get,
+                help="A workbook stacks the shipments and summaries of many weekly ledgers in two "
+                     "sheets; single week & route files stay available below each ledger")
+        
+        ledger_result = None
+        if uploaded_ledger_file:
+            ledger_key = results_key("ledgers", uploaded_ledger_file, {
+                "old_balances": consignor_old_balances, "store_only": store_only, "excel_mode": excel_mode})
+            if st.button("📊 Generate Weekly Ledgers", type="primary", use_container_width=True):
+                with st.spinner("Generating weekly ledgers..."):
+                    try:
+                        cache_stats = new_cache_stats() if use_pdf_cache else None
+                        run_stats = new_run_stats("ledgers")
+                        store_result(ledger_key, generate_weekly_ledgers(
+                            uploaded_ledger_file, consignor_old_balances, load_options, cache_stats, lazy=True,
+                            run_stats=run_stats), cache_stats, run_stats)
+                    except Exception as e:
+                        st.error(f"❌ Error: {str(e)}")
+                        st.exception(e)
+            ledger_result = get_result(ledger_key)
+
+        if ledger_result:
+            try:
+                ledger_data = ledger_result["data"]
+                cache_stats, run_stats = ledger_result["cache_stats"], ledger_result["run_stats"]
+                if st.button("♻️ Discard These Results", key="discard_ledgers",
+                             help="Forget these ledgers; the next Generate works them out again"):
+                    discard_result(ledger_key)
+                    st.rerun()
                     
-                    total_ledgers = sum(len(routes) for consignor in ledger_data.values() for routes in consignor.values())
+                total_ledgers = sum(len(routes) for consignor in ledger_data.values() for routes in consignor.values())
                     
+                st.markdown(f"""
+                <div class="success-message">
+                    <h3>✅ Success! Generated {total_ledgers} Weekly Ledgers</h3>
+                    <p>For {len(ledger_data)} consignor(s)</p>
+                </div>
+                """, unsafe_allow_html=True)
+                if cache_stats:
+                    show_cache_stats(cache_stats)
+                show_run_stats(run_stats, deferred=True)
+                
+                col1, col2 = st.columns(2)
+                with col1:
                     st.markdown(f"""
-                    <div class="success-message">
-                        <h3>✅ Success! Generated {total_ledgers} Weekly Ledgers</h3>
-                        <p>For {len(ledger_data)} consignor(s)</p>
+                    <div class="stats-box">
+                        <h2>{len(ledger_data)}</h2>
+                        <p>Consignors</p>
+                    </div>
+                    """, unsafe_allow_html=True)
+                with col2:
+                    st.markdown(f"""
+                    <div class="stats-box">
+                        <h2>{total_ledgers}</h2>
+                        <p>Weekly Ledgers (Bill + Ledger)</p>
                     </div>
                     """, unsafe_allow_html=True)
                     
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        st.markdown(f"""
-                        <div class="stats-box">
-                            <h2>{len(ledger_data)}</h2>
-                            <p>Consignors</p>
-                        </div>
-                        """, unsafe_allow_html=True)
-                    with col2:
-                        st.markdown(f"""
-                        <div class="stats-box">
-                            <h2>{total_ledgers}</h2>
-                            <p>Weekly Ledgers (Bill + Ledger)</p>
-                        </div>
-                        """, unsafe_allow_html=True)
-                    
-                    st.markdown("---")
-                    st.markdown("### 📥 Download Ledgers")
+                st.markdown("---")
+                st.markdown("### 📥 Download Ledgers")
                     
-                    # Create master ZIP with all ledgers
-                    master_zip = io.BytesIO()
-                    with zipfile.ZipFile(master_zip, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                        for consignor, weeks_data in ledger_data.items():
-                            for week_key, routes in weeks_data.items():
-                                for route_key, data in routes.items():
-                                    bill_name, bill_pdf = data["bill_pdf"]
-                                    ledger_name, ledger_pdf = data["ledger_pdf"]
-                                    excel_name, excel_content = data["excel"]
-                                    folder = f"{consignor}/{data['week_range']}"
-                                    zip_file.writestr(f"{folder}/{bill_name}", bill_pdf)
-                                    zip_file.writestr(f"{folder}/{ledger_name}", ledger_pdf)
-                                    zip_file.writestr(f"{folder}/{excel_name}", excel_content)
-                    master_zip.seek(0)
+                # Files are rendered when a download is clicked; once the master ZIP is built,
+                # consignor ZIPs and single files are copied from it
+                consignor_entries = ledger_entries(ledger_data, excel_mode)
+                all_entries = all_ledger_entries(ledger_data, excel_mode, consignor_entries)
+                all_ledgers = result_archive(ledger_result, "all", lambda: deferred_archive(
+                    all_entries, store_only, render_workers, cache_stats, run_stats=run_stats))
+                # Single week & route Excel files are only in the ZIPs with "per_ledger"
+                excel_source = all_ledgers if excel_mode == "per_ledger" else None
                     
+                st.download_button(
+                    label="📦 Download All Ledgers (ZIP)",
+                    data=all_ledgers,
+                    file_name=f"Weekly_Ledgers_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
+                    mime="application/zip",
+                    use_container_width=True
+                )
+                if excel_mode == "run":
                     st.download_button(
-                        label="📦 Download All Ledgers (ZIP)",
-                        data=master_zip,
-                        file_name=f"Weekly_Ledgers_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
-                        mime="application/zip",
+                        label="📊 Download All Ledgers (Excel Workbook)",
+                        data=deferred_document(all_entries[-1][1], cache_stats, all_ledgers, RUN_WORKBOOK_NAME),
+                        file_name=f"Weekly_Ledgers_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
+                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                         use_container_width=True
                     )
                     
-                    st.markdown("---")
-                    st.markdown("### 👤 Consignor-wise Ledgers")
+                st.markdown("---")
+                st.markdown("### 👤 Consignor-wise Ledgers")
                     
-                    for consignor in sorted(ledger_data.keys()):
-                        weeks_data = ledger_data[consignor]
-                        total_consignor_ledgers = sum(len(routes) for routes in weeks_data.values())
+                for consignor in sorted(ledger_data.keys()):
+                    weeks_data = ledger_data[consignor]
+                    total_consignor_ledgers = sum(len(routes) for routes in weeks_data.values())
                         
-                        with st.expander(f"👤 **{consignor}** - {total_consignor_ledgers} Week(s)", expanded=True):
-                            # Create consignor ZIP
-                            consignor_zip = io.BytesIO()
-                            with zipfile.ZipFile(consignor_zip, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                                for week_key, routes in weeks_data.items():
-                                    for route_key, data in routes.items():
-                                        bill_name, bill_pdf = data["bill_pdf"]
-                                        ledger_name, ledger_pdf = data["ledger_pdf"]
-                                        excel_name, excel_content = data["excel"]
-                                        folder = f"{data['week_range']}"
-                                        zip_file.writestr(f"{folder}/{bill_name}", bill_pdf)
-                                        zip_file.writestr(f"{folder}/{ledger_name}", ledger_pdf)
-                                        zip_file.writestr(f"{folder}/{excel_name}", excel_content)
-                            consignor_zip.seek(0)
-                            
+                    with st.expander(f"👤 **{consignor}** - {total_consignor_ledgers} Week(s)", expanded=True):
+                        st.download_button(
+                            label=f"📥 Download All for {consignor}",
+                            data=result_archive(ledger_result, consignor, lambda: deferred_archive(
+                                consignor_entries[consignor], store_only, render_workers, cache_stats,
+                                all_ledgers, f"{consignor}/")),
+                            file_name=f"{consignor.replace(' ', '_')}_Ledgers.zip",
+                            mime="application/zip",
+                            key=f"consignor_{consignor}"
+                        )
+                        if excel_mode == "consignor":
+                            workbook_name, workbook_job = consignor_entries[consignor][-1]
                             st.download_button(
-                                label=f"📥 Download All for {consignor}",
-                                data=consignor_zip,
-                                file_name=f"{consignor.replace(' ', '_')}_Ledgers.zip",
-                                mime="application/zip",
-                                key=f"consignor_{consignor}"
+                                label=f"📊 Excel Workbook for {consignor}",
+                                data=deferred_document(workbook_job, cache_stats, all_ledgers,
+                                                       f"{consignor}/{workbook_name}"),
+                                file_name=workbook_name,
+                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                                key=f"workbook_{consignor}"
                             )
                             
-                            st.markdown("---")
+                        st.markdown("---")
                             
-                            # Sort weeks chronologically
-                            sorted_weeks = sorted(weeks_data.keys())
+                        # Sort weeks chronologically
+                        sorted_weeks = sorted(weeks_data.keys())
                             
-                            for week_key in sorted_weeks:
-                                routes = weeks_data[week_key]
+                        for week_key in sorted_weeks:
+                            routes = weeks_data[week_key]
                                 
-                                # Get week range from first route's data
-                                first_route_data = next(iter(routes.values()))
-                                week_range = first_route_data['week_range']
+                            # Get week range from first route's data
+                            first_route_data = next(iter(routes.values()))
+                            week_range = first_route_data['week_range']
                                 
-                                st.markdown(f"#### 📅 {week_range}")
+                            st.markdown(f"#### 📅 {week_range}")
                                 
-                                for route_key, week_data in routes.items():
-                                    col1, col2, col3 = st.columns([2, 2, 2])
+                            for route_key, week_data in routes.items():
+                                col1, col2, col3 = st.columns([2, 2, 2])
                                     
-                                    with col1:
-                                        st.markdown(f"**{week_data['route']}**")
+                                with col1:
+                                    st.markdown(f"**{week_data['route']}**")
                                     
-                                    with col2:
-                                        summary = week_data["summary"]
-                                        st.caption(
-                                            f"Trips: {summary['total_trips']} | "
-                                            f"Weight: {summary['total_wt']:.0f} kg | "
-                                            f"Final Balance (Bill): ₹{summary['final_balance']:.2f}"
-                                        )
+                                with col2:
+                                    summary = week_data["summary"]
+                                    st.caption(
+                                        f"Trips: {summary['total_trips']} | "
+                                        f"Weight: {summary['total_wt']:.0f} kg | "
+                                        f"Final Balance (Bill): ₹{summary['final_balance']:.2f}"
+                                    )
                                     
-                                    with col3:
-                                        bill_name, bill_pdf = week_data["bill_pdf"]
-                                        ledger_name, ledger_pdf = week_data["ledger_pdf"]
-                                        excel_name, excel_content = week_data["excel"]
+                                with col3:
+                                    bill_name, bill_job = week_data["bill_pdf"]
+                                    ledger_name, ledger_job = week_data["ledger_pdf"]
+                                    excel_name, excel_job = week_data["excel"]
+                                    member = f"{consignor}/{week_data['week_range']}/"
                                         
-                                        st.download_button(
-                                            "🧾 Bill PDF",
-                                            data=bill_pdf,
-                                            file_name=bill_name,
-                                            mime="application/pdf",
-                                            key=f"bill_{consignor}_{week_key}_{route_key}"
-                                        )
-                                        st.download_button(
-                                            "📘 Ledger PDF",
-                                            data=ledger_pdf,
-                                            file_name=ledger_name,
-                                            mime="application/pdf",
-                                            key=f"ledger_{consignor}_{week_key}_{route_key}"
-                                        )
-                                        st.download_button(
-                                            "📊 Excel",
-                                            data=excel_content,
-                                            file_name=excel_name,
-                                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                                            key=f"excel_{consignor}_{week_key}_{route_key}"
-                                        )
+                                    st.download_button(
+                                        "🧾 Bill PDF",
+                                        data=deferred_document(bill_job, cache_stats, all_ledgers,
+                                                               member + bill_name),
+                                        file_name=bill_name,
+                                        mime="application/pdf",
+                                        key=f"bill_{consignor}_{week_key}_{route_key}"
+                                    )
+                                    st.download_button(
+                                        "📘 Ledger PDF",
+                                        data=deferred_document(ledger_job, cache_stats, all_ledgers,
+                                                               member + ledger_name),
+                                        file_name=ledger_name,
+                                        mime="application/pdf",
+                                        key=f"ledger_{consignor}_{week_key}_{route_key}"
+                                    )
+                                    st.download_button(
+                                        "📊 Excel",
+                                        data=deferred_document(excel_job, cache_stats, excel_source,
+                                                               member + excel_name),
+                                        file_name=excel_name,
+                                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                                        key=f"excel_{consignor}_{week_key}_{route_key}"
+                                    )
                                 
-                                st.markdown("---")
+                            st.markdown("---")
                 
-                except Exception as e:
-                    st.error(f"❌ Error: {str(e)}")
-                    st.exception(e)
+            except Exception as e:
+                st.error(f"❌ Error: {str(e)}")
+                st.exception(e)
     
     # ---------------- TAB 3: HOW IT WORKS ----------------
     with tab3:
@@ -1130,7 +2755,7 @@ def main():
         ### Challan Generation (Tab 1)
         
         **Step 1: Prepare Your Excel**
-        Your Excel file should contain these columns:
+        Your Excel file (or CSV/TSV export) should contain these columns:
         - **S. NO.** - Serial number (unique per challan)
         - **DATE** - Date (DD/MM/YYYY format)
         - **FROM** - Origin city
@@ -1242,30 +2867,22 @@ def main():
 
         uploaded_summary = st.file_uploader(
             "Upload Excel for Summary Report",
-            type=['xlsx', 'xls'],
+            type=UPLOAD_TYPES,
             key="summary_upload"
         )
 
         if uploaded_summary:
             st.markdown("### ⚙️ Optional Filters")
 
-            # Load data
-            xls = pd.ExcelFile(uploaded_summary)
-            df_sum = pd.concat([pd.read_excel(uploaded_summary, s, dtype=str) for s in xls.sheet_names],
-                            ignore_index=True)
-
-            # Clean columns
-            df_sum.columns = [c.strip() for c in df_sum.columns]
-            df_sum["CONSIGNOR"] = df_sum["CONSIGNOR"].apply(clean_consignor)
-            df_sum["WT"] = df_sum["WT. Kgs."].apply(clean_num)
-            df_sum["AMOUNT"] = df_sum["AMOUNT"].apply(clean_num)
-            df_sum["FREIGHT"] = df_sum["FREIGHT"].apply(clean_num)
+            # Load cleaned data
+            df_sum, _ = load_shipments(uploaded_summary, **load_options,
+                                       required_columns=PARTY_SUMMARY_COLUMNS)
 
             # Drop empty consignors
             df_sum = df_sum[df_sum["CONSIGNOR"] != ""]
 
             # Group summary
-            summary_df = df_sum.groupby("CONSIGNOR").agg(
+            summary_df = df_sum.groupby("CONSIGNOR", observed=True).agg(
                 SUM_WT=("WT", "sum"),
                 FREIGHT=("FREIGHT", "max"),
                 SUM_AMOUNT=("AMOUNT", "sum")
@@ -0,0 +1,229 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import challan  # noqa: E402
+
+HEADERS = ["S. NO.", "DATE", "FROM", "TO", "TRUCK NO.", "NAME OF THE DRIVER", "DRIVER MOB. NO.",
+           "CONSIGNOR", "CONSIGNEE", "WT. Kgs.", "NO. OF Pkgs", "FREIGHT", "AMOUNT", "Hire"]
+
+
+def shipment_rows(**overrides):
+    """Four shipments on two challans; overrides replace a column's values (None = blank)."""
+    columns = {
+        "S. NO.": ["1", "1", "2", "2"],
+        "DATE": ["02/01/2024", "02/01/2024", "09/01/2024", "09/01/2024"],
+        "FROM": ["DELHI", "DELHI", "DELHI", "NA"],
+        "TO": ["PUNE", "PUNE", "BHOPAL", "BHOPAL"],
+        "TRUCK NO.": ["MH12AB1234"] * 4,
+        "NAME OF THE DRIVER": ["RAMESH", "RAMESH", "SURESH", "SURESH"],
+        "DRIVER MOB. NO.": ["9876543210"] * 4,
+        "CONSIGNOR": ["ABC TRADERS", "ABC TRADERS", "None", "XYZ"],
+        "CONSIGNEE": ["PQR", "N/A", "LMN", "LMN"],
+        "WT. Kgs.": ["100", "200.5", "300", "#N/A"],
+        "NO. OF Pkgs": ["1", "2", "3", "4"],
+        "FREIGHT": ["10", "20", "30", "40"],
+        "AMOUNT": ["1000", "2000", "3000", "4000"],
+        "Hire": ["500", "0", "700", "0"],
+    }
+    for header, values in overrides.items():
+        columns[header] = [values] * 4 if values is None or isinstance(values, str) else values
+    return pd.DataFrame(columns, columns=HEADERS)
+
+
+@pytest.fixture(autouse=True)
+def isolated_state(tmp_path, monkeypatch):
+    monkeypatch.setattr(challan, "SNAPSHOT_DIR", str(tmp_path / "snapshots"))
+    monkeypatch.setattr(challan, "FINGERPRINT_STORE", str(tmp_path / "fingerprints.json"))
+    monkeypatch.setattr(challan, "PDF_CACHE_DIR", str(tmp_path / "pdf_cache"))
+    challan._load_shipments_cached.clear()
+
+
+def write_xlsx(tmp_path, rows, name="shipments.xlsx"):
+    path = tmp_path / name
+    rows.to_excel(path, index=False)
+    return str(path)
+
+
+def quiet(*args):
+    pass
+
+
+@pytest.mark.parametrize("column", ["NAME OF THE DRIVER", "CONSIGNOR"])
+def test_all_blank_cleaned_column(tmp_path, column):
+    path = write_xlsx(tmp_path, shipment_rows(**{column: None}))
+    df, report = challan.load_shipments(path, snapshots=False)
+    assert not report["sheet_errors"]
+    assert set(df[column]) == ({"NA"} if column == "NAME OF THE DRIVER" else {""})
+
+
+def test_all_blank_consignee_in_ledgers(tmp_path):
+    path = write_xlsx(tmp_path, shipment_rows(CONSIGNEE=None))
+    ledgers = challan.generate_weekly_ledgers(path, {}, {"snapshots": False}, lazy=True,
+                                              show_progress=quiet, show_report=quiet)
+    shipments = [shipment for weeks in ledgers.values() for routes in weeks.values()
+                 for data in routes.values() for shipment in data["bill_pdf"][1][1][3]]
+    assert shipments and {shipment["consignee"] for shipment in shipments} == {""}
+
+
+def test_streamed_workbook_matches_full_read(tmp_path):
+    path = write_xlsx(tmp_path, shipment_rows())
+    full, _ = challan.load_shipments(path, snapshots=False)
+    streamed, _ = challan.load_shipments(path, chunk_size=3, snapshots=False)
+    # values only: concatenated chunks drop unused categories such as the "" default
+    pd.testing.assert_frame_equal(streamed.astype(object), full.astype(object))
+    assert challan.list_routes(streamed) == challan.list_routes(full)
+
+
+def test_snapshot_from_other_cleaning_rules_is_not_reused(tmp_path, monkeypatch):
+    pytest.importorskip("pyarrow")
+    path = write_xlsx(tmp_path, shipment_rows(TO="BOMBAY"))
+    df, _ = challan.load_shipments(path)
+    assert set(df["TO"]) == {"MUMBAI"}
+    assert len(challan.list_snapshots()) == 1
+    monkeypatch.setattr(challan, "CITY_ALIASES", {})
+    challan._load_shipments_cached.clear()
+    df, _ = challan.load_shipments(path)
+    assert set(df["TO"]) == {"BOMBAY"}
+
+
+def test_incremental_plan_records_challans_only_once_written(tmp_path):
+    import zipfile
+    path = write_xlsx(tmp_path, shipment_rows())
+    plan = lambda: challan.plan_challan_documents(path, {}, {"snapshots": False}, incremental=True,
+                                                  show_report=quiet)
+    first, second = plan(), plan()
+    assert first[1] == second[1] > 0 and first[3] == second[3] == 0
+    with zipfile.ZipFile(tmp_path / "challans.zip", "w") as zf:
+        challan.process_excel_file(path, {}, zf, {"snapshots": False}, incremental=True, workers=1,
+                                   show_progress=quiet, show_report=quiet)
+    assert plan()[3] == first[1]
+
+
+def test_ledger_weeks_start_at_midnight(tmp_path):
+    dates = ["02/01/2024 10:30", "07/01/2024 23:15", "08/01/2024 08:00", "14/01/2024"]
+    path = write_xlsx(tmp_path, shipment_rows(DATE=dates, FROM="DELHI", CONSIGNOR="ABC TRADERS"))
+    ledgers = challan.generate_weekly_ledgers(path, {}, {"snapshots": False}, lazy=True,
+                                              show_progress=quiet, show_report=quiet)
+    weeks = {week_key: [(data["week_start"], data["week_end"], data["week_range"],
+                         data["summary"]["total_trips"]) for data in routes.values()]
+             for week_key, routes in ledgers["ABC TRADERS"].items()}
+    assert weeks == {
+        "2024-01-01": [(pd.Timestamp("2024-01-01"), pd.Timestamp("2024-01-07"), "01 Jan - 07 Jan 2024", 2)],
+        "2024-01-08": [(pd.Timestamp("2024-01-08"), pd.Timestamp("2024-01-14"), "08 Jan - 14 Jan 2024", 2)],
+    }
+
+
+def test_unusual_dates_do_not_reject_the_sheet(tmp_path):
+    dates = ["09/01/3024", "02/01/2024", "2024-01-05 10:30:00+05:30", "not a date"]
+    path = write_xlsx(tmp_path, shipment_rows(DATE=dates))
+    df, report = challan.load_shipments(path, snapshots=False)
+    assert not report["sheet_errors"]
+    assert df["DATE"].tolist()[:3] == [challan.parse_date_flexible(d).tz_localize(None) for d in dates[:3]]
+    assert pd.isna(df["DATE"].iloc[3]) and report["date_counts"]["unparsed"] == 1
+    month_wise_data = challan.plan_challan_documents(path, {}, {"snapshots": False}, show_report=quiet)[0]
+    assert "January_3024" in month_wise_data
+
+
+def test_party_summary_columns_are_enough_for_the_summary_tab(tmp_path):
+    rows = shipment_rows()[["CONSIGNOR", "WT. Kgs.", "FREIGHT", "AMOUNT"]]
+    path = write_xlsx(tmp_path, rows)
+    with pytest.raises(ValueError, match="No usable sheets"):
+        challan.load_shipments(path, snapshots=False)
+    df, report = challan.load_shipments(path, snapshots=False,
+                                        required_columns=challan.PARTY_SUMMARY_COLUMNS)
+    assert not report["sheet_errors"] and list(df.columns) == ["CONSIGNOR", "WT", "FREIGHT", "AMOUNT"]
+    assert df["WT"].sum() == 600.5
+
+
+def test_replayed_template_matches_drawing_it(tmp_path, monkeypatch):
+    import io
+    path = write_xlsx(tmp_path, shipment_rows())
+    month_wise_data = challan.plan_challan_documents(path, {}, {"snapshots": False}, show_report=quiet)[0]
+    meta, rows = next(job[1] for routes in month_wise_data.values() for docs in routes.values()
+                      for _, job in docs if job[0] == "challan")
+
+    def render():
+        buffer = io.BytesIO()
+        challan.draw_pdf(buffer, meta, rows)
+        return buffer.getvalue()
+
+    replayed = render()
+    monkeypatch.setattr(challan, "_can_replay", lambda c: False)
+    assert render() == replayed
+
+
+@pytest.mark.parametrize("second_mode", ["consolidated", "both"])
+def test_switching_output_mode_renders_the_other_documents(tmp_path, second_mode):
+    path = write_xlsx(tmp_path, shipment_rows())
+
+    def run(output_mode):
+        plan = challan.plan_challan_documents(path, {}, {"snapshots": False}, incremental=True,
+                                              output_mode=output_mode, show_report=quiet)
+        challan.save_fingerprints(plan[4])
+        return [fname for routes in plan[0].values() for docs in routes.values() for fname, _ in docs]
+
+    assert not any(fname.startswith("CHALLANS__") for fname in run("individual"))
+    books = [fname for fname in run(second_mode) if fname.startswith("CHALLANS__")]
+    assert len(books) == 3
+    assert not any(fname.startswith("CHALLANS__") for fname in run(second_mode))
+    assert not any(fname.startswith("CHALLANS__") for fname in run("consolidated"))
+    challan.forget_fingerprints()
+    run("consolidated")
+    assert len([fname for fname in run("individual") if fname.endswith("_to_PUNE.pdf")]) == 1
+
+
+def test_stage_memory_is_the_peak_of_that_stage():
+    if challan._rss_mb() is None:
+        pytest.skip("no /proc to read memory from")
+    run_stats = challan.new_run_stats("test")
+    with challan.timed_stage(run_stats, "large"):
+        block = bytearray(200 * 1024 * 1024)
+        block[::4096] = b"x" * len(block[::4096])
+        del block
+    with challan.timed_stage(run_stats, "small"):
+        pass
+    stages = run_stats["stages"]
+    assert stages["large"]["peak_rss_mb"] - stages["small"]["peak_rss_mb"] > 150
+
+
+def test_deferred_archive_reports_render_progress(tmp_path):
+    path = write_xlsx(tmp_path, shipment_rows())
+    month_wise_data = challan.plan_challan_documents(path, {}, {"snapshots": False}, show_report=quiet)[0]
+    entries = challan.challan_entries(month_wise_data)
+    run_stats = challan.new_run_stats("challans")
+    assert challan.run_stats_status(run_stats).startswith("⏳")
+    archive = challan.deferred_archive(entries, workers=1, run_stats=run_stats)
+    assert run_stats["render_status"] == "pending"
+    archive()
+    assert run_stats["render_status"] == "done" and challan.run_stats_status(run_stats) is None
+    assert run_stats["progress"]["done"] == run_stats["progress"]["total"] == len(entries)
+    assert run_stats["stages"]["render"]["docs"] == len(entries)
+
+
+@pytest.mark.parametrize("writer", ["xlsxwriter", "openpyxl"])
+def test_ledger_workbook_continues_shipments_past_the_row_limit(tmp_path, monkeypatch, writer):
+    import io
+    import openpyxl
+    if writer == "xlsxwriter":
+        pytest.importorskip("xlsxwriter")
+    else:
+        monkeypatch.setitem(sys.modules, "xlsxwriter", None)  # import fails: openpyxl is used
+    monkeypatch.setattr(challan, "EXCEL_MAX_ROWS", 3)
+    shipments = [{"date": f"0{day}/01/2024", "consignee": "PQR", "wt": 100.0 * day, "pkgs": day,
+                  "amount": 1000.0 * day} for day in range(1, 6)]
+    summary = {"total_trips": 5, "total_wt": 1500.0, "total_pkgs": 15, "total_amount": 15000.0,
+               "total_hire": 0.0, "net_amount": 15000.0, "previous_balance": 0.0, "final_balance": 15000.0}
+    buffer = io.BytesIO()
+    challan.write_ledger_workbook(buffer, [("ABC TRADERS", "DELHI → PUNE", "01 Jan - 07 Jan 2024",
+                                            shipments, summary)])
+    workbook = openpyxl.load_workbook(buffer)
+    assert workbook.sheetnames == ["Shipments", "Shipments (2)", "Shipments (3)", "Summary"]
+    sheets = [list(workbook[name].values) for name in workbook.sheetnames[:3]]
+    assert len({rows[0] for rows in sheets}) == 1  # each continuation repeats the header
+    assert [row[-1] for rows in sheets for row in rows[1:]] == [1000, 2000, 3000, 4000, 5000]
+    assert [len(rows) for rows in sheets] == [3, 3, 2]
+    assert list(workbook["Summary"].values)[1][:3] == ("01 Jan - 07 Jan 2024", "ABC TRADERS", "DELHI → PUNE")